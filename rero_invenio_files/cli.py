@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Click command-line interface for RERO-Invenio-Files."""
+
+import multiprocessing
+import os
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from invenio_access.permissions import system_identity
+from invenio_db import db
+from invenio_files_rest.models import ObjectVersion
+from invenio_search import current_search, current_search_client
+from invenio_search.engine import search
+from invenio_search.utils import build_alias_name
+
+from .proxies import current_rero_invenio_files
+from .records.components import ThumbnailAndFulltextComponent
+
+
+@click.group()
+def rero_files():
+    """RERO files commands."""
+
+
+def iter_parallel(func, batches, workers):
+    """Apply a function to batches using a pool of processes.
+
+    The number of pending batches is bounded to keep the memory footprint
+    low. The worker processes are forked with the current application
+    context.
+
+    :param func: callable - the function to apply to each batch.
+    :param batches: iterable - the batches.
+    :param workers: int - the number of processes, 1 runs in the current
+        process.
+    :returns: a generator of the function results.
+    """
+    if workers <= 1:
+        yield from map(func, batches)
+        return
+    batches = iter(batches)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=init_worker,
+        initargs=(current_app._get_current_object(),),
+    ) as executor:
+        pending = deque(
+            executor.submit(func, batch) for batch in islice(batches, workers * 2)
+        )
+        while pending:
+            result = pending.popleft().result()
+            if (batch := next(batches, None)) is not None:
+                pending.append(executor.submit(func, batch))
+            yield result
+
+
+def init_worker(app):
+    """Initialize a worker process.
+
+    :param app: Flask - the application of the parent process.
+    """
+    app.app_context().push()
+    # do not reuse the database connections of the parent process, the
+    # session scoped by thread ident is inherited by the forked process: it
+    # is dropped with the pooled connections without closing them
+    db.session.registry.clear()
+    db.engine.dispose(close=False)
+    # the search client of the parent process is built again on first use
+    current_search._client = None
+
+
+def iter_record_ids(batch_size, after=None):
+    """Get the identifiers of the records by batches.
+
+    The records are paginated by identifier, each page being a short query
+    fully fetched before the batch is processed.
+
+    :param batch_size: int - the number of records per batch.
+    :param after: UUID - the record identifier to start after.
+    :returns: a generator of lists of record identifiers.
+    """
+    model_cls = current_rero_invenio_files.records_service.record_cls.model_cls
+    while True:
+        query = db.session.query(model_cls.id).filter(model_cls.is_deleted.is_(False))
+        if after is not None:
+            query = query.filter(model_cls.id > after)
+        record_ids = [id_ for (id_,) in query.order_by(model_cls.id).limit(batch_size)]
+        if not record_ids:
+            return
+        yield record_ids
+        after = record_ids[-1]
+
+
+def build_index_actions(record_ids):
+    """Build the bulk index actions of a batch of records.
+
+    :param record_ids: list - the record UUIDs.
+    :returns: the list of bulk index actions and the number of records for
+        which the search document cannot be built.
+    """
+    service = current_rero_invenio_files.records_service
+    actions = []
+    errors = 0
+    for record in service.record_cls.get_records(record_ids):
+        try:
+            actions.append(
+                {
+                    "_op_type": "index",
+                    "_index": build_alias_name(service.record_to_index(record)),
+                    "_id": str(record.id),
+                    "_version": record.revision_id,
+                    "_version_type": "external_gte",
+                    "_source": record.dumps(),
+                }
+            )
+        except Exception:
+            current_app.logger.exception(
+                f"Failed to build the search document of the record {record.id}."
+            )
+            errors += 1
+    return actions, errors
+
+
+def index_batch(record_ids, chunk_size, max_chunk_bytes):
+    """Index a batch of records with bulk requests.
+
+    :param record_ids: list - the record UUIDs.
+    :param chunk_size: int - the maximal number of documents per request.
+    :param max_chunk_bytes: int - the maximal size in bytes of a request.
+    :returns: the number of indexed records and the number of errors.
+    """
+    actions, errors = build_index_actions(record_ids)
+    # the loaded records are not needed anymore
+    db.session.expunge_all()
+    indexed = 0
+    for ok, item in search.helpers.streaming_bulk(
+        current_search_client,
+        actions,
+        chunk_size=chunk_size,
+        max_chunk_bytes=max_chunk_bytes,
+        raise_on_error=False,
+        raise_on_exception=False,
+    ):
+        if ok:
+            indexed += 1
+        else:
+            current_app.logger.error(f"Failed to index a record: {item}")
+            errors += 1
+    return indexed, errors
+
+
+@rero_files.command()
+@click.option(
+    "-w", "--workers", default=1, show_default=True, help="Number of processes."
+)
+@click.option(
+    "-b",
+    "--batch-size",
+    default=500,
+    show_default=True,
+    help="Number of records built by a worker at once.",
+)
+@click.option(
+    "-c",
+    "--chunk-size",
+    default=500,
+    show_default=True,
+    help="Maximal number of documents per bulk request.",
+)
+@click.option(
+    "--max-chunk-bytes",
+    default=10 * 1024 * 1024,
+    show_default=True,
+    help="Maximal size in bytes of a bulk request.",
+)
+@click.option(
+    "-r",
+    "--max-rate",
+    default=0,
+    show_default=True,
+    help="Maximal number of records indexed per second, 0 for no limit.",
+)
+@with_appcontext
+def reindex(workers, batch_size, chunk_size, max_chunk_bytes, max_rate):
+    """Reindex all the records.
+
+    The record identifiers are read from the database by pages, the search
+    documents are built by parallel workers and sent by bulk requests.
+    """
+    start = time.monotonic()
+    indexed = errors = 0
+    for batch_indexed, batch_errors in iter_parallel(
+        partial(index_batch, chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes),
+        iter_record_ids(batch_size),
+        workers,
+    ):
+        indexed += batch_indexed
+        errors += batch_errors
+        if batch_errors:
+            click.secho(f"{batch_errors} indexing errors", fg="red", err=True)
+        elapsed = time.monotonic() - start
+        if max_rate and (delay := (indexed + errors) / max_rate - elapsed) > 0:
+            time.sleep(delay)
+        click.echo(
+            f"{indexed + errors} records processed "
+            f"({(indexed + errors) / (time.monotonic() - start):.1f} records/s)"
+        )
+    elapsed = time.monotonic() - start
+    click.secho(
+        f"{indexed} records indexed, {errors} errors in {elapsed:.1f}s",
+        fg="green" if not errors else "yellow",
+    )
+
+
+def iter_records_files(batch_size, after=None):
+    """Get the files of the records by batches of records.
+
+    The records are paginated by identifier, each page being a short query,
+    to allow database commits between the batches.
+
+    :param batch_size: int - the number of records per batch.
+    :param after: UUID - the record identifier to start after.
+    :returns: a generator of lists of record identifier and files tuples, the
+        files being a dict of mime type and metadata tuples by file key.
+    """
+    file_model_cls = (
+        current_rero_invenio_files.records_service.record_cls.files.file_cls.model_cls
+    )
+    while True:
+        query = db.session.query(file_model_cls.record_id).filter(
+            file_model_cls.is_deleted.is_(False)
+        )
+        if after is not None:
+            query = query.filter(file_model_cls.record_id > after)
+        record_ids = [
+            id_
+            for (id_,) in query.distinct()
+            .order_by(file_model_cls.record_id)
+            .limit(batch_size)
+        ]
+        if not record_ids:
+            return
+        files = {id_: {} for id_ in record_ids}
+        for file_model, obj in (
+            db.session.query(file_model_cls, ObjectVersion)
+            .join(
+                ObjectVersion,
+                file_model_cls.object_version_id == ObjectVersion.version_id,
+            )
+            .filter(
+                file_model_cls.is_deleted.is_(False),
+                file_model_cls.record_id.in_(record_ids),
+            )
+        ):
+            files[file_model.record_id][file_model.key] = (
+                obj.mimetype,
+                file_model.json.get("metadata") or {},
+            )
+        yield list(files.items())
+        after = record_ids[-1]
+
+
+def regenerate_derivatives_batch(batch):
+    """Create again the derived files of a batch of records.
+
+    :param batch: tuple - the identifier of the last record of the batch and
+        the list of record identifier and file keys tuples.
+    :returns: the identifier of the last record of the batch, the number of
+        regenerated files and the number of failures.
+    """
+    last_id, records = batch
+    service = current_rero_invenio_files.records_files_service
+    record_cls = service.record_cls
+    done = failed = 0
+    for record_id, file_keys in records:
+        pid = record_cls.get_record(record_id).pid.pid_value
+        for file_key in file_keys:
+            try:
+                item = service.create_derivatives(system_identity, pid, file_key)
+                status = item.to_dict()["metadata"].get("derivation_status")
+            except Exception:
+                current_app.logger.exception(
+                    f"Failed to create the derived files for {pid}:{file_key}."
+                )
+                status = "failed"
+            if status == "failed":
+                failed += 1
+            else:
+                done += 1
+    return last_id, done, failed
+
+
+@rero_files.command("regenerate-derivatives")
+@click.option(
+    "-w", "--workers", default=1, show_default=True, help="Number of processes."
+)
+@click.option(
+    "-b",
+    "--batch-size",
+    default=100,
+    show_default=True,
+    help="Number of records processed by a worker at once.",
+)
+@click.option(
+    "-c",
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    help="File to store the progress to resume an interrupted run.",
+)
+@click.option(
+    "-n", "--dry-run", is_flag=True, help="Only report the files to regenerate."
+)
+@with_appcontext
+def regenerate_derivatives(workers, batch_size, checkpoint, dry_run):
+    """Create the missing or outdated thumbnails and fulltexts.
+
+    The derived files are outdated when they have been created with other
+    parameters than the current configuration or when the derivation failed.
+    """
+    after = None
+    if checkpoint and os.path.exists(checkpoint):
+        with open(checkpoint) as checkpoint_file:
+            after = uuid.UUID(checkpoint_file.read().strip())
+        click.echo(f"Resuming after the record {after}")
+
+    def iter_work():
+        """Get the outdated files by batches of records."""
+        for records in iter_records_files(batch_size, after):
+            outdated = []
+            for record_id, files in records:
+                if keys := ThumbnailAndFulltextComponent.get_outdated_files(files):
+                    outdated.append((record_id, keys))
+            yield records[-1][0], outdated
+
+    start = time.monotonic()
+    records = done = failed = 0
+    if dry_run:
+        for _, outdated in iter_work():
+            records += len(outdated)
+            done += sum(len(keys) for _, keys in outdated)
+        click.echo(f"{done} files of {records} records to regenerate")
+        return
+    for last_id, batch_done, batch_failed in iter_parallel(
+        regenerate_derivatives_batch, iter_work(), workers
+    ):
+        done += batch_done
+        failed += batch_failed
+        if checkpoint:
+            with open(checkpoint, "w") as checkpoint_file:
+                checkpoint_file.write(str(last_id))
+        click.echo(
+            f"{done + failed} files regenerated "
+            f"({(done + failed) / (time.monotonic() - start):.1f} files/s)"
+        )
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    click.secho(
+        f"{done} files regenerated, {failed} errors",
+        fg="green" if not failed else "yellow",
+    )
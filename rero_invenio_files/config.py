@@ -30,3 +30,209 @@ RERO_FILES_RECORD_RESOURCE_CONFIG = (
 RERO_FILES_RECORD_FILE_RESOURCE_CONFIG = (
     "rero_invenio_files.records.resources.FileResourceConfig"
 )
+
+RERO_FILES_DERIVATION_ASYNC = False
+"""Create the thumbnails and the fulltexts in a background task.
+
+When enabled, committing a file only queues a celery task and the file
+metadata ``derivation_status`` is set to ``pending`` until the task is done.
+"""
+
+RERO_FILES_DERIVATION_ENGINES = [
+    "rero_invenio_files.records.engines.DocumentEngine",
+    "rero_invenio_files.records.engines.ImageEngine",
+]
+"""Engines creating the derived files, the first matching mime type is used.
+
+The engines registered with the ``rero_invenio_files.derivation_engines``
+entry point group take precedence. Other available engines:
+``TextEngine`` for plain text, ``OfficeEngine`` for office documents using
+LibreOffice and ``FFmpegEngine`` for video and audio files using ffmpeg.
+"""
+
+RERO_FILES_DERIVATION_QUEUES = {}
+"""Celery queues by engine cost class, e.g. ``{"expensive": "derivation"}``.
+
+The expensive engines always run in a background task, the default queue is
+used for the cost classes without queue.
+"""
+
+RERO_FILES_DERIVATION_COMMAND_TIMEOUT = 300
+"""Maximal duration in seconds of the external conversion commands."""
+
+RERO_FILES_DERIVATION_TIMEOUT = None
+"""Maximal duration in seconds of a derivation step, None for no limit.
+
+The limited derivation steps run in a subprocess which is killed when a
+limit is exceeded, the file metadata ``derivation_status`` is then set to
+``failed`` and ``derivation_error`` gives the reason. It is also the
+ImageMagick time limit.
+
+The subprocess is forked with ``multiprocessing`` from the process running
+the derivation, a celery prefork worker or a web worker for the page images.
+The file is copied locally before the fork, the subprocess does not read the
+storage.
+"""
+
+RERO_FILES_DERIVATION_CPU_LIMIT = None
+"""Maximal CPU time in seconds of a derivation step, None for no limit."""
+
+RERO_FILES_DERIVATION_MEMORY_LIMIT = None
+"""Maximal resident memory in bytes of a derivation step, None for no limit.
+
+The memory of the subprocess is checked regularly, it needs ``/proc``.
+"""
+
+RERO_FILES_DERIVATION_INSTRUMENTATIONS = []
+"""Instrumentations measuring the derivation steps.
+
+Each step is measured with its duration, the sizes of the file and of the
+derived files, the page count and the failure reason, labelled by mime type.
+Available instrumentations in ``rero_invenio_files.records.metrics``:
+``PrometheusInstrumentation`` for Prometheus metrics,
+``OpenTelemetryInstrumentation`` for trace spans and
+``InMemoryInstrumentation`` to collect the measurements in the tests.
+"""
+
+RERO_FILES_FULLTEXT_PROCESSES = 1
+"""Number of processes used to extract the fulltext of a PDF file.
+
+With more than one process, the pages are split into ranges extracted in
+parallel by a pool of processes.
+"""
+
+RERO_FILES_FULLTEXT_PARALLEL_MIN_PAGES = 200
+"""Number of pages below which the fulltext extraction stays serial."""
+
+RERO_FILES_THUMBNAIL_SIZE = 200
+"""Maximal width and height of the thumbnails in pixels."""
+
+RERO_FILES_THUMBNAIL_QUALITY = 95
+"""JPEG quality of the thumbnails."""
+
+RERO_FILES_THUMBNAIL_RENDITIONS = []
+"""Additional sizes of thumbnails in pixels.
+
+All the sizes are created from a single decoding of the file and stored as
+distinct derived files, for example ``file-pdf.64.jpg`` for the 64 pixels
+rendition of ``file.pdf``.
+"""
+
+RERO_FILES_THUMBNAIL_FORMATS = {}
+"""Additional thumbnail formats with their quality, e.g. ``{"webp": 80}``.
+
+The thumbnails are stored in each format, ``file-pdf.webp`` for example, and
+the thumbnail content is negotiated using the ``Accept`` request header: a
+format is sent when the client lists it, with a quality not lower than jpeg.
+The formats not supported by the ImageMagick build, avif is often missing, are
+ignored.
+"""
+
+RERO_FILES_THUMBNAIL_MAX_DISTORTION = None
+"""Maximal root mean square distortion of the thumbnails, between 0 and 1.
+
+When set, each thumbnail format is encoded with decreasing qualities,
+starting from its configured quality, and the smallest encoding of this format
+under this distortion is kept. The formats are not compared with each other,
+the format sent is chosen by the ``Accept`` request header.
+"""
+
+RERO_FILES_THUMBNAIL_MAX_PIXELS = 100_000_000
+"""Maximal number of decoded pixels of an image to create a thumbnail.
+
+JPEG images are decoded close to the thumbnail size, so their limit applies
+to the downscaled image. None disables the limit.
+"""
+
+RERO_FILES_THUMBNAIL_MEMORY_LIMIT = 512 * 1024 * 1024
+"""Maximal memory in bytes used by ImageMagick to decode an image.
+
+The memory, memory map and disk of the pixel cache are limited, a larger
+image makes the thumbnail creation fail. None disables the limit.
+"""
+
+RERO_FILES_PAGE_IMAGE_WIDTHS = [400, 800, 1600]
+"""Widths in pixels of the page images, the first one is the default.
+
+The pages are rendered on each request, or once if the page image cache is
+enabled. A requested width is rounded up to the next configured width to
+bound the number of cached images.
+"""
+
+RERO_FILES_PAGE_IMAGE_CACHE_SIZE = 0
+"""Maximal number of page images kept in the cache, 0 disables the cache.
+
+The page images are cached like the derived files, with their own size to
+keep the thumbnails and fulltexts of the derivative cache. Without the cache,
+the files on a remote storage are downloaded for each rendered page.
+"""
+
+RERO_FILES_PAGE_IMAGE_QUALITY = 85
+"""JPEG quality of the page images."""
+
+RERO_FILES_PDF_LINEARIZE = False
+"""Store a linearized copy of the uploaded PDF files.
+
+The copy, ``file-pdf.linear.pdf`` for example, is sent instead of the
+original file by the content endpoint: the browsers can display the first
+page before the end of the download. The PDF files already linearized are
+not copied.
+"""
+
+RERO_FILES_PDF_SPOOL_SIZE = 10 * 1024 * 1024
+"""Maximal size in bytes of a generated PDF file kept in memory.
+
+The larger files generated by the file service are spooled to a temporary
+file before being stored.
+"""
+
+RERO_FILES_PDF_OPTIONS = {}
+"""Size options of the PDF files generated by the file service.
+
+For example ``dict(strip_fonts=True, compression_level=9,
+object_streams=True)``, see ``PDFGenerator``.
+"""
+
+RERO_FILES_DERIVATIVE_CACHE_SIZE = 0
+"""Maximal number of derived files kept in the cache, 0 disables the cache.
+
+The derived files are cached using the checksum of the original file and the
+derivation parameters, a file uploaded in several records is derived once.
+The size is checked every ``DerivativeCache.evict_interval`` added entries.
+The cache needs the ``objects_derivatives_cache`` table: on an existing
+instance, create it with ``invenio db create`` before enabling the cache.
+"""
+
+RERO_FILES_FULLTEXT_INDEX_MAX_SIZE = 5 * 1024 * 1024
+"""Maximal size in bytes of the fulltext added to the search documents."""
+
+RERO_FILES_FULLTEXT_INDEX_CHUNK_SIZE = 100 * 1024
+"""Size in bytes of the fulltext chunks added to the search documents."""
+
+RERO_FILES_CONTENT_OFFLOAD = None
+"""Hand the file content transfers over to the front proxy.
+
+The permissions are checked by the application, then the file is sent by
+the proxy: ``x-accel-redirect`` for nginx, ``x-sendfile`` for Apache or
+lighttpd, or ``redirect`` to a presigned URL of the object storage. The
+contents are streamed by the application when None or when the file cannot
+be offloaded.
+"""
+
+RERO_FILES_CONTENT_OFFLOAD_LOCATIONS = {}
+"""Proxy locations by storage directory, e.g. ``{"/data/files": "/files"}``.
+
+The ``x-accel-redirect`` mode needs an internal nginx location serving the
+storage directory. With ``x-sendfile``, the file path is used when it is not
+in a configured directory.
+"""
+
+RERO_FILES_CONTENT_PRESIGNED_URL_FACTORY = None
+"""Function returning a presigned URL of a file, for the ``redirect`` mode.
+
+It is called with the ``FileInstance`` and the URL lifetime in seconds, and
+returns None if the file cannot be redirected.
+"""
+
+RERO_FILES_CONTENT_PRESIGNED_URL_EXPIRES = 60
+"""Lifetime in seconds of the presigned URLs."""
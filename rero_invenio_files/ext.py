@@ -17,9 +17,12 @@
 
 """Files support for the RERO invenio instances."""
 
+from importlib_metadata import entry_points
 from invenio_base.utils import obj_or_import_string
 
 from . import config
+from .records.cache import DerivativeCache, PageImageCache
+from .records.engines import DerivationEngineRegistry
 from .records.resources import FileResource, RecordResource
 from .records.services import RecordFileService, RecordService
 
@@ -36,9 +39,33 @@ class REROInvenioFiles(object):
         """Flask application initialization."""
         self.init_config(app)
         app.extensions["rero-invenio-files"] = self
+        self.derivative_cache = DerivativeCache()
+        self.page_image_cache = PageImageCache()
+        self.init_derivation_engines(app)
+        self.derivation_instrumentations = [
+            obj_or_import_string(instrumentation)()
+            for instrumentation in app.config["RERO_FILES_DERIVATION_INSTRUMENTATIONS"]
+        ]
         self.init_services(app)
         self.init_resources(app)
 
+    def init_derivation_engines(self, app):
+        """Initialize the derivation engines registry.
+
+        The engines from the entry points are registered before the
+        configured ones to take precedence.
+        """
+        self.derivation_engines = DerivationEngineRegistry()
+        engines = [
+            ep.load()
+            for ep in entry_points(group="rero_invenio_files.derivation_engines")
+        ] + [
+            obj_or_import_string(engine)
+            for engine in app.config["RERO_FILES_DERIVATION_ENGINES"]
+        ]
+        for engine in engines:
+            self.derivation_engines.register(engine())
+
     def service_configs(self, app):
         """Custom service configs."""
 
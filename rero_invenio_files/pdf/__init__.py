@@ -17,15 +17,301 @@
 
 """Pdf support for the RERO invenio instances."""
 
+import copy
+import hashlib
 import os
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from io import BytesIO
+from itertools import islice
+from pathlib import Path
 
+import fitz
+from fontTools import subset, ttLib
 from fpdf import FPDF
+from fpdf.enums import TextEmphasis
+from fpdf.fonts import SubsetMap, TTFFont
+from fpdf.output import OutputProducer, PDFFontStream, PDFXmpMetadata, PDFXObject
+from fpdf.syntax import Name, PDFContentStream
+
+FONT_DIR = os.path.join(os.path.dirname(__file__), "fonts")
+"""Directory of the fonts embedded in the generated PDF files."""
+
+FONTS = [
+    ("NotoSans", "", "NotoSans-Regular.ttf"),
+    ("NotoSans", "I", "NotoSans-Italic.ttf"),
+]
+"""Family, style and file name of the fonts used by the PDF generator."""
+
+LINEARIZE_OPTIONS = dict(garbage=3, deflate=True, linear=True)
+"""PyMuPDF save options of the linearized PDF files."""
+
+OBJECT_STREAMS_OPTIONS = dict(garbage=3, deflate=True, use_objstms=1)
+"""PyMuPDF save options packing the PDF objects into object streams."""
+
+STRIPPED_FONT_TABLES = ["cmap", "name", "post", "gasp", "STAT"]
+"""Font tables removed by the aggressive subsetting.
+
+The PDF readers map the characters to the glyphs using the document
+CIDToGIDMap and ToUnicode streams, these tables are optional in an embedded
+CID font.
+"""
+
+
+def rewrite_pdf(content, **options):
+    """Save again a PDF document using PyMuPDF.
+
+    :param content: bytes - the PDF binary content.
+    :param options: dict - the PyMuPDF save options.
+    :returns: the new PDF binary content.
+    """
+    with fitz.open(stream=bytes(content), filetype="pdf") as document:
+        return document.tobytes(**options)
+
+
+def linearize_pdf(content):
+    """Linearize a PDF document for the fast web view.
+
+    The unused objects are also removed and the streams compressed.
+
+    :param content: bytes - the PDF binary content.
+    :returns: the linearized PDF binary content.
+    """
+    return rewrite_pdf(content, **LINEARIZE_OPTIONS)
+
+
+def strip_font(content):
+    """Remove the hinting and the optional tables of an embedded font.
+
+    The glyph identifiers are kept, as they are used by the CIDToGIDMap.
+
+    :param content: bytes - the subset TrueType font.
+    :returns: the stripped TrueType font.
+    """
+    font = ttLib.TTFont(BytesIO(content))
+    options = subset.Options(hinting=False, retain_gids=True, notdef_outline=True)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(glyphs=font.getGlyphOrder())
+    subsetter.subset(font)
+    for tag in STRIPPED_FONT_TABLES:
+        if tag in font:
+            del font[tag]
+    output = BytesIO()
+    font.save(output)
+    return output.getvalue()
+
+
+@lru_cache(maxsize=None)
+def load_font(fname):
+    """Parse a TrueType font file once per process.
+
+    :param fname: str - the path of the font file.
+    :returns: the font file content and the parsed font, used as template.
+    """
+    with open(fname, "rb") as font_file:
+        content = font_file.read()
+    return content, TTFFont(FPDF(), fname, "", "")
+
+
+def load_fonts():
+    """Parse the fonts used by the PDF generator, in a new process."""
+    for _, _, fname in FONTS:
+        load_font(os.path.join(FONT_DIR, fname))
+
+
+def copy_font(fpdf, fname, fontkey, style):
+    """Get a font of a document from the parsed fonts.
+
+    The glyph metrics are shared by all the documents. Each document has its
+    own glyph subset and its own font tables, as they are changed by the
+    subsetting when the document is written.
+
+    :param fpdf: FPDF - the document using the font.
+    :param fname: str - the path of the font file.
+    :param fontkey: str - the font key in the document.
+    :param style: str - the font style, I for italic.
+    :returns: the font of the document.
+    """
+    content, template = load_font(fname)
+    font = TTFFont.__new__(TTFFont)
+    for name in TTFFont.__slots__:
+        # the harfbuzz font is created on demand for each document
+        if name != "hbfont" and hasattr(template, name):
+            setattr(font, name, getattr(template, name))
+    # the descriptor is completed with the font stream of each document
+    font.desc = copy.copy(template.desc)
+    font.i = len(fpdf.fonts) + 1
+    font.fontkey = fontkey
+    font.emphasis = TextEmphasis.coerce(style)
+    font.ttfont = ttLib.TTFont(
+        BytesIO(content), recalcTimestamp=False, fontNumber=0, lazy=True
+    )
+    font.missing_glyphs = []
+    # the characters mapped on their actual unicode, as in TTFFont
+    identities = "\x00 \r\n"
+    if fpdf.str_alias_nb_pages:
+        identities += "0123456789" + fpdf.str_alias_nb_pages
+    font.subset = SubsetMap(font, [ord(char) for char in identities])
+    return font
+
+
+def render_pdf(data, linearize=False, **options):
+    """Render the PDF file of a given data.
+
+    :param data: dict - the given data.
+    :param linearize: bool - linearize the PDF for the fast web view.
+    :param options: dict - the PDFGenerator size options.
+    :returns: the PDF binary content.
+    """
+    pdf = PDFGenerator(data, **options)
+    pdf.render()
+    return bytes(pdf.output(linearize=linearize))
+
+
+def render_pdf_chunk(data_chunk, **kwargs):
+    """Render the PDF files of a chunk of data.
+
+    :param data_chunk: list of dict - the given data.
+    :param kwargs: dict - the ``render_pdf`` options.
+    :returns: the list of the PDF binary contents.
+    """
+    return [render_pdf(data, **kwargs) for data in data_chunk]
+
+
+def render_pdfs(data_list, linearize=False, processes=1, chunk_size=16, **options):
+    """Render a PDF file for each given data.
+
+    The fonts are parsed once per process. Several processes render the
+    files in parallel, by chunks of data. The number of pending chunks is
+    bounded: the data are read as the files are consumed.
+
+    :param data_list: iterable of dict - the given data.
+    :param linearize: bool - linearize the PDF for the fast web view.
+    :param processes: int - the number of processes to use.
+    :param chunk_size: int - the number of files rendered by a process at
+        once.
+    :returns: a generator of the PDF binary contents in the data order.
+    """
+    if processes <= 1:
+        for data in data_list:
+            yield render_pdf(data, linearize=linearize, **options)
+        return
+    data_list = iter(data_list)
+    chunks = iter(lambda: list(islice(data_list, chunk_size)), [])
+    with ProcessPoolExecutor(processes, initializer=load_fonts) as executor:
+        pending = deque(
+            executor.submit(render_pdf_chunk, chunk, linearize=linearize, **options)
+            for chunk in islice(chunks, processes * 2)
+        )
+        while pending:
+            contents = pending.popleft().result()
+            if (chunk := next(chunks, None)) is not None:
+                pending.append(
+                    executor.submit(
+                        render_pdf_chunk, chunk, linearize=linearize, **options
+                    )
+                )
+            yield from contents
+
+
+class StreamBuffer:
+    """Output buffer of a PDF document writing to a stream.
+
+    Only the size and the checksum of the written content are kept, for the
+    cross-reference table and the file identifier.
+    """
+
+    def __init__(self, stream):
+        """Constructor.
+
+        :param stream: file object - the writable stream.
+        """
+        self.stream = stream
+        self.size = 0
+        self.hash = hashlib.md5(usedforsecurity=False)  # nosec B324
+
+    def __iadd__(self, data):
+        """Write data to the stream."""
+        self.stream.write(data)
+        self.size += len(data)
+        self.hash.update(data)
+        return self
+
+    def __len__(self):
+        """Size of the written content."""
+        return self.size
+
+
+class PDFOutputProducer(OutputProducer):
+    """Serialize a PDF document with the PDFGenerator size options.
+
+    The embedded fonts are stripped and the streams compressed again at the
+    given level before the serialization. If a stream is given, each PDF
+    object is written to the stream once it is serialized.
+    """
+
+    def __init__(self, fpdf, stream=None):
+        """Constructor.
+
+        :param fpdf: PDFGenerator - the document to write.
+        :param stream: file object - the writable stream, the content is
+            returned as a bytearray if not given.
+        """
+        super().__init__(fpdf)
+        if stream is not None:
+            self.buffer = StreamBuffer(stream)
+
+    def _add_pdf_obj(self, pdf_obj, trace_label=None):
+        """Register a PDF object, optimizing its content."""
+        # the images keep their own encoding, the XMP metadata are left
+        # uncompressed for the external tools
+        excluded = (PDFXObject, PDFXmpMetadata)
+        if isinstance(pdf_obj, PDFContentStream) and not isinstance(pdf_obj, excluded):
+            self.optimize_stream(pdf_obj)
+        return super()._add_pdf_obj(pdf_obj, trace_label)
+
+    def optimize_stream(self, pdf_obj):
+        """Strip the embedded fonts and set the stream compression level.
+
+        :param pdf_obj: PDFContentStream - the PDF stream object.
+        """
+        strip_fonts = self.fpdf.strip_fonts and isinstance(pdf_obj, PDFFontStream)
+        level = self.fpdf.compression_level
+        if not strip_fonts and level is None:
+            return
+        contents = pdf_obj._contents
+        if isinstance(contents, str):
+            contents = contents.encode("latin1")
+        if pdf_obj.filter == Name("FlateDecode"):
+            contents = zlib.decompress(contents)
+        if strip_fonts:
+            contents = strip_font(contents)
+            pdf_obj.length1 = len(contents)
+        if level is None:
+            level = PDFContentStream._COMPRESSION_LEVEL
+        if level == 0:
+            pdf_obj.filter = None
+        else:
+            contents = zlib.compress(contents, level=level)
+            pdf_obj.filter = Name("FlateDecode")
+        pdf_obj._contents = contents
+        pdf_obj.length = len(contents)
 
 
 class PDFGenerator(FPDF):
     """Generate a PDF file from a given data."""
 
-    def __init__(self, data, *arg, **kwargs):
+    def __init__(
+        self,
+        data,
+        *arg,
+        strip_fonts=False,
+        compression_level=None,
+        object_streams=False,
+        **kwargs,
+    ):
         """Create a PDFGenerator object.
 
         Example of input data:
@@ -37,22 +323,45 @@ class PDFGenerator(FPDF):
                 summary='Summary'
             )
         :param data: dict - the given data.
+        :param strip_fonts: bool - remove the hinting and the optional tables
+            of the embedded font subsets.
+        :param compression_level: int - the zlib compression level of the
+            streams, from 0 (not compressed) to 9, None for the fpdf2 default.
+        :param object_streams: bool - pack the PDF objects into compressed
+            object streams, using PyMuPDF.
         """
         self.data = data
-        font_dir = os.path.join(os.path.dirname(__file__), "fonts")
+        self.document_starts = []
+        self.strip_fonts = strip_fonts
+        self.compression_level = compression_level
+        self.object_streams = object_streams
         super().__init__(*arg, **kwargs)
-        self.add_font(
-            "NotoSans",
-            style="",
-            fname=os.path.join(font_dir, "NotoSans-Regular.ttf"),
-            uni=True,
-        )
-        self.add_font(
-            "NotoSans",
-            style="I",
-            fname=os.path.join(font_dir, "NotoSans-Italic.ttf"),
-            uni=True,
-        )
+        # the font files are parsed once per process
+        for family, style, fname in FONTS:
+            fontkey = f"{family.lower()}{style}"
+            self.fonts[fontkey] = copy_font(
+                self, os.path.join(FONT_DIR, fname), fontkey, style
+            )
+
+    @classmethod
+    def render_collection(cls, data_list, *arg, **kwargs):
+        """Render several data into a single PDF document.
+
+        Each data is rendered on its own pages, the fonts and the other
+        resources of the document are shared. The pages are numbered per
+        data.
+
+        :param data_list: iterable of dict - the given data.
+        :returns: the PDFGenerator object, to output.
+        """
+        pdf = None
+        for data in data_list:
+            if pdf is None:
+                pdf = cls(data, *arg, **kwargs)
+            else:
+                pdf.data = data
+            pdf.render()
+        return pdf
 
     def header(self):
         """Generate the header page."""
@@ -69,6 +378,7 @@ class PDFGenerator(FPDF):
     def render(self):
         """Render the main pdf page body."""
         self.add_page()
+        self.document_starts.append(self.page_no())
         if title := self.data.get("title"):
             self.set_font("NotoSans", size=24)
             self.multi_cell(0, 8, title, align="C")
@@ -87,5 +397,91 @@ class PDFGenerator(FPDF):
         """Generate the page footer."""
         self.set_y(-15)
         self.set_font("NotoSans", "I", 8)
-        # printing the page number
-        self.cell(0, 10, f"Page {self.page_no()}/{{nb}}", align="C", border="T")
+        # printing the page number in the rendered data
+        start = self.document_starts[-1] if self.document_starts else 1
+        self.cell(
+            0, 10, f"Page {self.page_no() - start + 1}/{{nb}}", align="C", border="T"
+        )
+
+    def _substitute_page_number(self):
+        """Replace the page count alias by the page count of each data."""
+        starts = sorted({1, *self.document_starts, self.pages_count + 1})
+        for start, stop in zip(starts, starts[1:]):
+            for number in range(start, stop):
+                page = self.pages[number]
+                # the unicode fonts and the core fonts encodings
+                for encoding in ["utf-16-be", "latin-1"]:
+                    page.contents = page.contents.replace(
+                        self.str_alias_nb_pages.encode(encoding),
+                        str(stop - start).encode(encoding),
+                    )
+
+    def get_rewrite_options(self, linearize=False):
+        """Save options of PyMuPDF applied to the generated document.
+
+        :param linearize: bool - linearize the PDF for the fast web view.
+        :returns: the save options, empty if the document is not rewritten.
+        """
+        options = {}
+        if self.object_streams:
+            options.update(OBJECT_STREAMS_OPTIONS)
+        if linearize:
+            options.update(LINEARIZE_OPTIONS)
+        return options
+
+    def output(self, name="", *args, linearize=False, **kwargs):
+        """Output the PDF document.
+
+        :param name: str - the file path or the file object to write to.
+        :param linearize: bool - linearize the PDF for the fast web view,
+            using PyMuPDF.
+        :returns: the PDF binary content if no name is given.
+        """
+        kwargs.setdefault("output_producer_class", PDFOutputProducer)
+        if not (options := self.get_rewrite_options(linearize)):
+            return super().output(name, *args, **kwargs)
+        content = rewrite_pdf(super().output("", *args, **kwargs), **options)
+        if not name:
+            return content
+        if isinstance(name, (str, os.PathLike)):
+            Path(name).write_bytes(content)
+        else:
+            name.write(content)
+
+    def output_to_stream(self, stream, linearize=False):
+        """Write the PDF document to a stream.
+
+        The PDF objects are written one by one, the whole binary content is
+        never held in memory, thus the document can be written only once. A
+        document rewritten by PyMuPDF, to be linearized for example, is
+        written at once, as PyMuPDF needs the whole content.
+
+        :param stream: file object - the writable stream, a spooled temporary
+            file or a storage stream for example.
+        :param linearize: bool - linearize the PDF for the fast web view,
+            using PyMuPDF.
+        :returns: the number of bytes written.
+        """
+        if self.get_rewrite_options(linearize):
+            content = self.output(linearize=linearize)
+            stream.write(content)
+            return len(content)
+        return len(
+            super().output(
+                output_producer_class=partial(PDFOutputProducer, stream=stream)
+            )
+        )
+
+    def _default_file_id(self, buffer):
+        """Identifier of the document based on its content.
+
+        :param buffer: bytearray or StreamBuffer - the written content.
+        :returns: the file identifier.
+        """
+        if not isinstance(buffer, StreamBuffer):
+            return super()._default_file_id(buffer)
+        id_hash = buffer.hash.copy()
+        if self.creation_date:
+            id_hash.update(self.creation_date.strftime("%Y%m%d%H%M%S").encode("utf8"))
+        hash_hex = id_hash.hexdigest().upper()
+        return f"<{hash_hex}><{hash_hex}>"
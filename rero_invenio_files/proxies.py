@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Helper proxy to the state object."""
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+current_rero_invenio_files = LocalProxy(
+    lambda: current_app.extensions["rero-invenio-files"]
+)
+"""Helper proxy to get the current RERO-Invenio-Files extension."""
@@ -18,6 +18,7 @@
 """Files support for the RERO invenio instances."""
 
 from invenio_pidstore.providers.recordid_v2 import RecordIdProviderV2
+from invenio_records.dumpers import SearchDumper
 from invenio_records.systemfields import ConstantField, ModelField
 from invenio_records_resources.records.api import FileRecord as FileRecordBase
 from invenio_records_resources.records.api import Record as RecordBase
@@ -28,6 +29,7 @@ from invenio_records_resources.records.systemfields import (
 )
 
 from . import models
+from .dumpers import FulltextDumperExt
 
 
 class FileRecord(FileRecordBase):
@@ -49,6 +51,8 @@ class Record(RecordBase):
     index = IndexField("records-record-v1.0.0", search_alias="records")
     # persistant identifier
     pid = PIDField("id", provider=RecordIdProviderV2)
+    # search dumper with the files fulltext
+    dumper = SearchDumper(extensions=[FulltextDumperExt()])
 
 
 class RecordWithFile(Record):
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Derived files cache."""
+
+from collections import Counter
+from datetime import datetime, timedelta
+
+from flask import current_app
+from invenio_db import db
+from invenio_files_rest.models import ObjectVersion
+from sqlalchemy.exc import IntegrityError
+
+from .models import DerivativeCacheMetadata
+
+
+class DerivativeCache:
+    """Derived files cache keyed by the checksum of the original file.
+
+    The cached derived files are shared between the records having the same
+    original file. The least recently used entries are evicted when the
+    cache size exceeds ``RERO_FILES_DERIVATIVE_CACHE_SIZE``.
+    """
+
+    size_config = "RERO_FILES_DERIVATIVE_CACHE_SIZE"
+    """Configuration variable of the maximal number of entries."""
+
+    touch_interval = timedelta(minutes=10)
+    """Minimal delay between two updates of the access time of an entry.
+
+    The hits are counted in memory and stored with the access time, a cache
+    hit does not write to the database each time.
+    """
+
+    evict_interval = 100
+    """Number of added entries between two evictions by a process.
+
+    The cache size can be exceeded by as many entries per process, the
+    entries are not counted each time.
+    """
+
+    def __init__(self):
+        """Constructor."""
+        self.hits = 0
+        self.misses = 0
+        self.pending_hits = Counter()
+        self.added = 0
+
+    @property
+    def max_size(self):
+        """Maximum number of entries, 0 disables the cache."""
+        return current_app.config[self.size_config]
+
+    @property
+    def entries(self):
+        """Query of the cache entries, the page images have their own cache."""
+        return DerivativeCacheMetadata.query.filter(
+            ~DerivativeCacheMetadata.params.like(f"{PageImageCache.derivation}:%")
+        )
+
+    @staticmethod
+    def params_key(derivation, **params):
+        """Build the key of the derivation parameters.
+
+        :param derivation: str - the derivation type such as thumbnail.
+        :param params: dict - the derivation parameters.
+        :returns: the parameters key.
+        """
+        return ":".join(
+            [derivation] + [f"{name}={value}" for name, value in sorted(params.items())]
+        )
+
+    def get(self, checksum, derivation, **params):
+        """Get a cached derived file.
+
+        :param checksum: str - the checksum of the original file.
+        :param derivation: str - the derivation type such as thumbnail.
+        :param params: dict - the derivation parameters.
+        :returns: the derived file instance or None.
+        """
+        if not self.max_size or not checksum:
+            return
+        entry = DerivativeCacheMetadata.query.filter_by(
+            checksum=checksum, params=self.params_key(derivation, **params)
+        ).one_or_none()
+        if entry is None or not entry.file.readable:
+            self.misses += 1
+            return
+        self.hits += 1
+        key = (checksum, entry.params)
+        self.pending_hits[key] += 1
+        if entry.updated < datetime.utcnow() - self.touch_interval:
+            # also updates the access time used by the eviction
+            entry.hits += self.pending_hits.pop(key)
+        return entry.file
+
+    def set(self, checksum, file_instance, derivation, **params):
+        """Add a derived file to the cache.
+
+        :param checksum: str - the checksum of the original file.
+        :param file_instance: FileInstance - the derived file instance.
+        :param derivation: str - the derivation type such as thumbnail.
+        :param params: dict - the derivation parameters.
+        :returns: the parameters key and the file instance identifier of
+            the evicted or replaced entries.
+        """
+        if not self.max_size or not checksum:
+            return []
+        table = DerivativeCacheMetadata.__table__
+        params_key = self.params_key(derivation, **params)
+        try:
+            with db.session.begin_nested():
+                db.session.execute(
+                    table.insert().values(
+                        checksum=checksum, params=params_key, file_id=file_instance.id
+                    )
+                )
+        except IntegrityError:
+            # the entry exists, or has been added by a concurrent derivation
+            condition = (table.c.checksum == checksum) & (table.c.params == params_key)
+            replaced = db.session.execute(
+                db.select(table.c.file_id).where(condition)
+            ).scalar()
+            db.session.execute(
+                table.update()
+                .where(condition)
+                .values(file_id=file_instance.id, updated=datetime.utcnow())
+            )
+            if replaced in [None, file_instance.id]:
+                return []
+            return [(params_key, replaced)]
+        self.added += 1
+        if self.added % self.evict_interval:
+            return []
+        return self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries exceeding the cache size.
+
+        The file instances are kept, they can still be used by some records.
+
+        :returns: the parameters key and the file instance identifier of
+            the evicted entries.
+        """
+        query = self.entries
+        evicted = []
+        if (exceeding := query.count() - self.max_size) > 0:
+            with db.session.begin_nested():
+                for entry in query.order_by(DerivativeCacheMetadata.updated).limit(
+                    exceeding
+                ):
+                    evicted.append((entry.params, entry.file_id))
+                    db.session.delete(entry)
+        return evicted
+
+    @staticmethod
+    def get_unused_files(file_ids):
+        """Get the file instances used neither by a record nor by the cache.
+
+        :param file_ids: list - the file instance identifiers.
+        :returns: the set of the unused file instance identifiers.
+        """
+        if not file_ids:
+            return set()
+        used = {
+            file_id
+            for model_cls in [ObjectVersion, DerivativeCacheMetadata]
+            for (file_id,) in db.session.query(model_cls.file_id).filter(
+                model_cls.file_id.in_(file_ids)
+            )
+        }
+        return set(file_ids) - used
+
+    def stats(self):
+        """Cache statistics.
+
+        :returns: a dict with the hits and misses of the current process and
+            the number of cached entries.
+        """
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            size=self.entries.count(),
+        )
+
+
+class PageImageCache(DerivativeCache):
+    """Rendered page images cache keyed by the checksum of the original file.
+
+    The page images are stored in the same table as the other derived files
+    with their own size, ``RERO_FILES_PAGE_IMAGE_CACHE_SIZE``: browsing a
+    long document does not evict the thumbnails and fulltexts.
+    """
+
+    size_config = "RERO_FILES_PAGE_IMAGE_CACHE_SIZE"
+
+    derivation = "page"
+    """Derivation type of the page images."""
+
+    @property
+    def entries(self):
+        """Query of the cached page images."""
+        return DerivativeCacheMetadata.query.filter(
+            DerivativeCacheMetadata.params.like(f"{self.derivation}:%")
+        )
@@ -19,20 +19,114 @@
 
 import contextlib
 import os
+import tempfile
+import time
 from io import BytesIO
 
 import fitz
+from flask import current_app
+from invenio_files_rest.models import ObjectVersion
+from invenio_records_resources.proxies import current_service_registry
 from invenio_records_resources.services.errors import FileKeyNotFoundError
 from invenio_records_resources.services.files.components.base import (
     FileServiceComponent,
 )
-from wand.color import Color
-from wand.image import Image
+from invenio_records_resources.services.uow import RecordCommitOp, RecordIndexOp, TaskOp
+
+from ..proxies import current_rero_invenio_files
+from .cache import DerivativeCache
+from .engines import is_image_format_supported
+from .metrics import Measurement
+from .pages import PageIndexer
+from .sandbox import run_in_sandbox
+from .streams import IterStream, LocalFile
+from .tasks import create_derivatives
+
+
+class DerivationContext(LocalFile):
+    """File shared by all the derivation steps of a record file.
+
+    The pdf document is parsed only once and its page count and metadata are
+    available to all the steps. The derivation engines can keep intermediate
+    results, such as a converted file, in ``extras``.
+    """
+
+    def __init__(self, file_record):
+        """Constructor.
+
+        :param file_record: FileRecord - the record file.
+        """
+        super().__init__(file_record)
+        self._document = None
+        self.extras = {}
+
+    @classmethod
+    def from_path(cls, file_path):
+        """Get the context of a local file without file record.
+
+        :param file_path: str - the path of the file.
+        :returns: the context, the file is not removed on exit.
+        """
+        context = cls(None)
+        context._path = file_path
+        return context
+
+    def enter_context(self, context_manager):
+        """Keep a context manager open until the end of the derivation.
+
+        :param context_manager: the context manager to enter.
+        :returns: the result of the context manager.
+        """
+        return self._stack.enter_context(context_manager)
+
+    def copy(self):
+        """Get a new context of the same local file.
+
+        The copy has its own document and extras, it is used by a derivation
+        step running in a subprocess. The local file is made by the current
+        process if needed.
+
+        :returns: the new context, to be closed by the caller.
+        """
+        context = self.__class__(self.file_record)
+        context._path = self.path
+        return context
+
+    @property
+    def document(self):
+        """Open PyMuPDF document of the file, pdf or epub for example."""
+        if self._document is None:
+            # the stored files have no extension
+            _, extension = os.path.splitext(
+                self._path if self.file_record is None else self.file_record.key
+            )
+            self._document = self.enter_context(
+                fitz.open(self.path, filetype=extension[1:].lower() or None)
+            )
+        return self._document
+
+    @property
+    def is_parsed(self):
+        """The document has already been opened."""
+        return self._document is not None
+
+    @property
+    def page_count(self):
+        """Number of pages of the pdf document."""
+        return self.document.page_count
+
+    @property
+    def metadata(self):
+        """Metadata of the pdf document such as the title or the author."""
+        return self.document.metadata
 
 
 class ThumbnailAndFulltextComponent(FileServiceComponent):
     """Basic image metadata extractor."""
 
+    derived_types = ["thumbnail", "fulltext", "pages", "linearized"]
+    """Types of the derived files, stored in their metadata."""
+
     @staticmethod
     def change_filename_extension(filename, extension):
         """Return filename with the given extension.
@@ -51,122 +145,689 @@ class ThumbnailAndFulltextComponent(FileServiceComponent):
         ext = ext.replace(".", "")
         return f"{basename}-{ext}.{extension}"
 
-    @staticmethod
-    def create_thumbnail_from_file(file_path, mimetype):
+    @classmethod
+    def create_thumbnail_from_file(cls, file_path, mimetype, size=200, quality=95):
         """Create a thumbnail from given file path and return image blob.
 
         :param file_path: Full path of file.
         :param mimetype: Mime type of the file.
+        :param size: Maximal width and height of the thumbnail.
+        :param quality: JPEG quality of the thumbnail.
         :returns: the binary data.
         """
-        # Thumbnail can only be done from images or PDFs.
-        if not mimetype.startswith("image/") and mimetype != "application/pdf":
+        if thumbnails := cls.create_thumbnails_from_file(
+            file_path, mimetype, [dict(size=size, quality=quality)]
+        ):
+            return thumbnails[0]
+
+    @classmethod
+    def create_thumbnails_from_file(cls, file_path, mimetype, renditions):
+        """Create thumbnails of several sizes and formats from given file path.
+
+        The thumbnails are created by the derivation engine of the mime type.
+
+        :param file_path: Full path of file.
+        :param mimetype: Mime type of the file.
+        :param renditions: list of dict - the thumbnail ``size``, ``quality``
+            and optional ``format`` (jpg by default) and ``max_distortion``.
+        :returns: the list of binary data in the renditions order, None if
+            no thumbnail can be created.
+        """
+        engine = cls.get_engine(mimetype)
+        if not engine or not engine.thumbnail:
+            return None
+        with DerivationContext.from_path(file_path) as context:
+            return engine.create_thumbnails(context, mimetype, renditions)
+
+    @classmethod
+    def iter_fulltext_from_file(cls, file_path, mimetype):
+        """Extract the fulltext of a given file page by page.
+
+        The fulltext is extracted by the derivation engine of the mime type.
+
+        :param file_path: str - the path of the file.
+        :param mimetype: str - the mime type of the file.
+        :returns: a generator of utf-8 encoded text chunks, the pages are
+            separated by a page break.
+        """
+        engine = cls.get_engine(mimetype)
+        if not engine or not engine.fulltext:
             return
+        with DerivationContext.from_path(file_path) as context:
+            yield from engine.iter_fulltext(context, mimetype)
+
+    @classmethod
+    def create_fulltext_from_file(cls, file_path, mimetype):
+        """Extract the fulltext for a given file.
+
+        :param file_path: str - the path of the file.
+        :param mimetype: str - the mime type of the file.
+        :returns: the extracted text, the pages are separated by a new line.
+        :rtype: str
+        """
+        engine = cls.get_engine(mimetype)
+        if not engine or not engine.fulltext:
+            return
+        return b"".join(
+            PageIndexer(cls.iter_fulltext_from_file(file_path, mimetype))
+        ).decode()
+
+    @staticmethod
+    def get_engine(mimetype):
+        """Get the derivation engine of a mime type.
 
-        # For PDF, we take only the first page
-        if mimetype == "application/pdf":
-            # Append [0] force to take only the first page
-            # file_path = file_path + "[0]"
-            max_width = max_height = 200
-            with fitz.open(file_path) as pdf_document:
-                page = pdf_document[0]
-                scale_factor = min(
-                    max_width / page.rect.width, max_height / page.rect.height
+        :param mimetype: str - the mime type of the file.
+        :returns: the derivation engine or None.
+        """
+        return current_rero_invenio_files.derivation_engines.get(mimetype)
+
+    @classmethod
+    def has_derivatives(cls, mimetype):
+        """Check if a thumbnail or a fulltext can be created for a mime type.
+
+        :param mimetype: str - the mime type of the file.
+        :returns: True if some derived files can be created.
+        """
+        return cls.get_engine(mimetype) is not None
+
+    @staticmethod
+    def get_thumbnail_sizes():
+        """Get the sizes of the thumbnails from the configuration.
+
+        :returns: the list of sizes, the default thumbnail size first.
+        """
+        size = current_app.config["RERO_FILES_THUMBNAIL_SIZE"]
+        return [size] + sorted(
+            set(current_app.config["RERO_FILES_THUMBNAIL_RENDITIONS"]) - {size}
+        )
+
+    @staticmethod
+    def get_thumbnail_formats():
+        """Get the formats of the thumbnails from the configuration.
+
+        The formats not supported by the ImageMagick build are ignored.
+
+        :returns: a dict of the qualities by format, jpg first.
+        """
+        formats = dict(jpg=current_app.config["RERO_FILES_THUMBNAIL_QUALITY"])
+        for image_format, quality in current_app.config[
+            "RERO_FILES_THUMBNAIL_FORMATS"
+        ].items():
+            if is_image_format_supported(image_format):
+                formats[image_format] = quality
+        return formats
+
+    @classmethod
+    def get_thumbnail_extension(cls, size=None, image_format="jpg"):
+        """Get the extension of the derived file of a thumbnail size.
+
+        :param size: int - the thumbnail size, None for the default size.
+        :param image_format: str - the thumbnail format.
+        :returns: the extension of the derived file.
+        """
+        if size is None or size == current_app.config["RERO_FILES_THUMBNAIL_SIZE"]:
+            return image_format
+        return f"{size}.{image_format}"
+
+    @classmethod
+    def get_derivation_params(cls):
+        """Get the current derivation parameters from the configuration.
+
+        :returns: a dict of the parameters by derived file extension.
+        """
+        max_distortion = current_app.config["RERO_FILES_THUMBNAIL_MAX_DISTORTION"]
+        params = {}
+        for size in cls.get_thumbnail_sizes():
+            for image_format, quality in cls.get_thumbnail_formats().items():
+                rendition = dict(size=size, quality=quality)
+                if image_format != "jpg":
+                    rendition["format"] = image_format
+                if max_distortion:
+                    rendition["max_distortion"] = max_distortion
+                params[cls.get_thumbnail_extension(size, image_format)] = (
+                    "thumbnail",
+                    rendition,
                 )
-                pixmap = page.get_pixmap(matrix=fitz.Matrix(scale_factor, scale_factor))
-                return pixmap.tobytes(output="jpg", jpg_quality=95)
+        params["txt"] = ("fulltext", {})
+        params["txt.idx"] = ("pages", {})
+        if current_app.config["RERO_FILES_PDF_LINEARIZE"]:
+            params["linear.pdf"] = ("linearized", {})
+        return params
 
+    @classmethod
+    def get_outdated_files(cls, files):
+        """Get the original files with missing or outdated derived files.
+
+        A derived file is outdated when it has been created with other
+        derivation parameters than the current ones.
+
+        :param files: dict - the mime type and the metadata of the record
+            files by file key.
+        :returns: the list of the original file keys to derive again.
+        """
+        params = {
+            extension: (file_type, DerivativeCache.params_key(file_type, **file_params))
+            for extension, (
+                file_type,
+                file_params,
+            ) in cls.get_derivation_params().items()
+        }
+        outdated = []
+        for key, (mimetype, metadata) in files.items():
+            if metadata.get("type") in cls.derived_types:
+                continue
+            if not (engine := cls.get_engine(mimetype)):
+                continue
+            status = metadata.get("derivation_status")
+            for extension, (file_type, params_key) in params.items():
+                if not getattr(engine, file_type):
+                    continue
+                _, derived = files.get(
+                    cls.change_filename_extension(key, extension), (None, {})
+                )
+                # a file without text has no fulltext nor page index, an
+                # already linearized pdf has no linearized copy
+                optional = file_type in ["fulltext", "linearized"] or (
+                    file_type == "pages"
+                    and cls.change_filename_extension(key, "txt") not in files
+                )
+                if optional and not derived and status == "done":
+                    continue
+                if status == "failed" or derived.get("params") != params_key:
+                    outdated.append(key)
+                    break
+        return outdated
+
+    def add_derived_file(
+        self, identity, record, file_key, file_type, extension, stream, params=None
+    ):
+        """Store a derived file (thumbnail, fulltext) of a given record file.
+
+        The file service components are run directly on the given record as
+        the permissions have already been checked for the original file.
+
+        :param identity: flask principal Identity
+        :param record: obj - record instance.
+        :param file_key: str - key of the original file.
+        :param file_type: str - the derived file type: thumbnail or fulltext.
+        :param extension: str - the extension of the derived file.
+        :param stream: file like object - the content of the derived file.
+        :param params: str - the key of the derivation parameters.
+        """
+        sf = self.service
+        recid = record.pid.pid_value
+        derived_key = self.change_filename_extension(file_key, extension)
+        sf.run_components(
+            "init_files",
+            identity,
+            recid,
+            record,
+            [
+                {
+                    "key": derived_key,
+                    "type": file_type,
+                    f"{file_type}_for": file_key,
+                    "params": params,
+                }
+            ],
+            uow=self.uow,
+        )
+        sf.run_components(
+            "set_file_content",
+            identity,
+            recid,
+            derived_key,
+            stream,
+            None,
+            record,
+            uow=self.uow,
+        )
+        sf.run_components(
+            "commit_file", identity, recid, derived_key, record, uow=self.uow
+        )
+
+    def index_record(self, record):
+        """Index the record to update the fulltext in the search document.
+
+        :param record: obj - record instance.
+        """
+        self.uow.register(
+            RecordIndexOp(
+                record, indexer=current_rero_invenio_files.records_service.indexer
+            )
+        )
+
+    def set_derivation_status(self, record, file_key, status, error=None):
+        """Store the derivation status in the file metadata.
+
+        :param record: obj - record instance.
+        :param file_key: str - file key in the file record.
+        :param status: str - one of pending, done or failed.
+        :param error: str - the reason of the failure, stored as
+            ``derivation_error``.
+        """
+        file_record = record.files[file_key]
+        if file_record.metadata is None:
+            file_record.metadata = {}
+        file_record.metadata["derivation_status"] = status
+        if error:
+            file_record.metadata["derivation_error"] = error
         else:
-            # Create the image thumbnail
-            with Image(filename=file_path) as img:
-                img.format = "jpg"
-                img.background_color = Color("white")
-                img.alpha_channel = "remove"
-                img.transform(resize="200x")
+            file_record.metadata.pop("derivation_error", None)
+        self.uow.register(RecordCommitOp(file_record))
+
+    def link_derived_file(
+        self, record, file_key, file_type, extension, file_instance, params=None
+    ):
+        """Add an existing file instance as derived file of a given record file.
 
-                return img.make_blob()
+        :param record: obj - record instance.
+        :param file_key: str - key of the original file.
+        :param file_type: str - the derived file type: thumbnail or fulltext.
+        :param extension: str - the extension of the derived file.
+        :param file_instance: FileInstance - the existing derived file.
+        :param params: str - the key of the derivation parameters.
+        """
+        derived_key = self.change_filename_extension(file_key, extension)
+        record.files.create(
+            derived_key,
+            obj=ObjectVersion.create(
+                record.bucket, derived_key, _file_id=file_instance
+            ),
+            data={"type": file_type, f"{file_type}_for": file_key, "params": params},
+        )
 
     @staticmethod
-    def create_fulltext_from_file(file_path, mimetype):
-        """Extract the fulltext for a given pdf file.
+    def get_derived_keys(record, file_key, file_type):
+        """Get the keys of the derived files of a given record file.
+
+        :param record: obj - record instance.
+        :param file_key: str - key of the original file.
+        :param file_type: str - the derived file type: thumbnail or fulltext.
+        :returns: the list of the derived file keys.
+        """
+        return [
+            key
+            for key, file_record in record.files.items()
+            if (file_record.get("metadata") or {}).get(f"{file_type}_for") == file_key
+        ]
+
+    def remove_derived_files(self, record, file_key, file_type):
+        """Remove the existing derived files of a given record file.
+
+        The file instances are kept as they can be shared by the derivative
+        cache.
+
+        :param record: obj - record instance.
+        :param file_key: str - key of the original file.
+        :param file_type: str - the derived file type: thumbnail or fulltext.
+        :returns: True if a derived file has been removed.
+        """
+        keys = self.get_derived_keys(record, file_key, file_type)
+        for key in keys:
+            record.files.delete(key, remove_rf=True)
+        return bool(keys)
+
+    def get_derived_file_instance(self, record, file_key, extension):
+        """Get the stored file instance of a derived file.
+
+        :param record: obj - record instance.
+        :param file_key: str - key of the original file.
+        :param extension: str - the extension of the derived file.
+        :returns: the file instance.
+        """
+        derived_key = self.change_filename_extension(file_key, extension)
+        return ObjectVersion.get(record.bucket_id, derived_key).file
+
+    @staticmethod
+    @contextlib.contextmanager
+    def measure(step, mimetype, input_bytes=None):
+        """Measure a derivation step for the configured instrumentations.
+
+        :param step: str - the derivation step, thumbnail or fulltext.
+        :param mimetype: str - the mime type of the original file.
+        :param input_bytes: int - the size of the original file.
+        :returns: a context manager of the ``Measurement`` to complete.
+        """
+        measurement = Measurement(step, mimetype, input_bytes)
+        instrumentations = current_rero_invenio_files.derivation_instrumentations
+        with contextlib.ExitStack() as stack:
+            for instrumentation in instrumentations:
+                stack.enter_context(instrumentation.measure(measurement))
+            start = time.perf_counter()
+            try:
+                yield measurement
+            except Exception as error:
+                measurement.error = str(error)
+                measurement.error_type = error.__class__.__name__
+                raise
+            finally:
+                measurement.duration = time.perf_counter() - start
+
+    @staticmethod
+    def get_derivation_limits():
+        """Get the resource limits of a derivation step.
+
+        :returns: a dict of the timeout, CPU and memory limits, empty if the
+            derivation steps are not limited.
+        """
+        config = current_app.config
+        limits = dict(
+            timeout=config["RERO_FILES_DERIVATION_TIMEOUT"],
+            cpu_limit=config["RERO_FILES_DERIVATION_CPU_LIMIT"],
+            memory_limit=config["RERO_FILES_DERIVATION_MEMORY_LIMIT"],
+        )
+        return limits if any(limits.values()) else {}
+
+    @classmethod
+    def run_engine_step(cls, context, step, *args, stream=False):
+        """Run a derivation engine step, in a sandbox if it is limited.
+
+        When limits are configured, the step runs in a subprocess with its
+        own copy of the context, a step exceeding a limit raises a
+        ``DerivationError``. A streamed result is written to a temporary
+        file by the subprocess.
+
+        :param context: DerivationContext - the file shared by the
+            derivation steps.
+        :param step: callable - the engine method, called with the context
+            and the given arguments.
+        :param stream: bool - the step returns an iterable of bytes chunks.
+        :returns: the step result.
+        """
+        limits = cls.get_derivation_limits()
+        if not limits:
+            return step(context, *args)
+        output = None
+        if stream:
+            output = os.path.join(
+                context.enter_context(tempfile.TemporaryDirectory()), "output"
+            )
+
+        # the file is copied locally by the parent process, once for all the
+        # steps, the subprocess only opens its own document
+        step_context = context.copy()
+
+        def sandboxed():
+            with step_context:
+                result = step(step_context, *args)
+                if output is None:
+                    return result
+                with open(output, "wb") as output_file:
+                    for chunk in result or []:
+                        output_file.write(chunk)
+
+        result = run_in_sandbox(sandboxed, **limits)
+        if output is None:
+            return result
+        return cls.iter_file(output)
+
+    @staticmethod
+    def iter_file(file_path, chunk_size=1024 * 1024):
+        """Read a file by chunks.
 
         :param file_path: str - the path of the file.
-        :param mimetype: str - the mime type of the file.
-        :returns: the extracted text.
-        :rtype: str
+        :param chunk_size: int - the size in bytes of the chunks.
+        :returns: a generator of bytes chunks.
         """
-        if mimetype != "application/pdf":
+        with open(file_path, "rb") as input_file:
+            while chunk := input_file.read(chunk_size):
+                yield chunk
+
+    def create_thumbnail(self, identity, record, file_key, context):
+        """Create the thumbnails of a given file.
+
+        All the missing thumbnail sizes and formats are created from a single
+        decoding of the file.
+
+        :param identity: flask principal Identity
+        :param record: obj - record instance.
+        :param file_key: str - file key in the file record.
+        :param context: DerivationContext - the file shared by the
+            derivation steps.
+        """
+        rfile = record.files[file_key].file
+        engine = self.get_engine(rfile.mimetype)
+        if not engine or not engine.thumbnail:
+            return
+        cache = current_rero_invenio_files.derivative_cache
+        self.remove_derived_files(record, file_key, "thumbnail")
+        missing = []
+        for extension, (file_type, params) in self.get_derivation_params().items():
+            if file_type != "thumbnail":
+                continue
+            if file_instance := cache.get(rfile.checksum, "thumbnail", **params):
+                self.link_derived_file(
+                    record,
+                    file_key,
+                    "thumbnail",
+                    extension,
+                    file_instance,
+                    cache.params_key("thumbnail", **params),
+                )
+            else:
+                missing.append((extension, params))
+        if not missing:
             return
-        with fitz.open(file_path) as pdf_file:
-            text = [page.get_text("text") for page in pdf_file]
-            return "\n".join(text)
+        thumbnails = self.run_engine_step(
+            context,
+            engine.create_thumbnails,
+            rfile.mimetype,
+            [params for _, params in missing],
+        )
+        for (extension, params), blob in zip(missing, thumbnails or []):
+            self.add_derived_file(
+                identity,
+                record,
+                file_key,
+                "thumbnail",
+                extension,
+                BytesIO(blob),
+                cache.params_key("thumbnail", **params),
+            )
+            cache.set(
+                rfile.checksum,
+                self.get_derived_file_instance(record, file_key, extension),
+                "thumbnail",
+                **params,
+            )
+
+    def create_fulltext(self, identity, record, file_key, context):
+        """Create the fulltext of a given file and its page index.
+
+        :param identity: flask principal Identity
+        :param record: obj - record instance.
+        :param file_key: str - file key in the file record.
+        :param context: DerivationContext - the file shared by the
+            derivation steps.
+        """
+        rfile = record.files[file_key].file
+        engine = self.get_engine(rfile.mimetype)
+        if not engine or not engine.fulltext:
+            return
+        cache = current_rero_invenio_files.derivative_cache
+        params_key = cache.params_key("fulltext")
+        pages_params_key = cache.params_key("pages")
+        # the search document has to be updated if the fulltext changes
+        changed = self.remove_derived_files(record, file_key, "fulltext")
+        self.remove_derived_files(record, file_key, "pages")
+        if (file_instance := cache.get(rfile.checksum, "fulltext")) and (
+            pages_instance := cache.get(rfile.checksum, "pages")
+        ):
+            self.link_derived_file(
+                record, file_key, "fulltext", "txt", file_instance, params_key
+            )
+            self.link_derived_file(
+                record, file_key, "pages", "txt.idx", pages_instance, pages_params_key
+            )
+            changed = True
+        else:
+            chunks = self.run_engine_step(
+                context, engine.iter_fulltext, rfile.mimetype, stream=True
+            )
+            indexer = PageIndexer(chunks)
+            with IterStream(indexer) as stream:
+                if stream.peek():
+                    self.add_derived_file(
+                        identity,
+                        record,
+                        file_key,
+                        "fulltext",
+                        "txt",
+                        stream,
+                        params_key,
+                    )
+                    self.add_derived_file(
+                        identity,
+                        record,
+                        file_key,
+                        "pages",
+                        "txt.idx",
+                        BytesIO(indexer.to_bytes()),
+                        pages_params_key,
+                    )
+                    for file_type, extension in [
+                        ("fulltext", "txt"),
+                        ("pages", "txt.idx"),
+                    ]:
+                        cache.set(
+                            rfile.checksum,
+                            self.get_derived_file_instance(record, file_key, extension),
+                            file_type,
+                        )
+                    changed = True
+        if changed:
+            self.index_record(record)
+
+    def create_linearized(self, identity, record, file_key, context):
+        """Create a linearized copy of a given pdf file.
+
+        The linearized copy is sent instead of the original file, the first
+        page can be displayed before the end of the download.
+
+        :param identity: flask principal Identity
+        :param record: obj - record instance.
+        :param file_key: str - file key in the file record.
+        :param context: DerivationContext - the file shared by the
+            derivation steps.
+        """
+        rfile = record.files[file_key].file
+        engine = self.get_engine(rfile.mimetype)
+        if not engine or not engine.linearized:
+            return
+        cache = current_rero_invenio_files.derivative_cache
+        params_key = cache.params_key("linearized")
+        self.remove_derived_files(record, file_key, "linearized")
+        if file_instance := cache.get(rfile.checksum, "linearized"):
+            self.link_derived_file(
+                record, file_key, "linearized", "linear.pdf", file_instance, params_key
+            )
+            return
+        output_path = os.path.join(
+            context.enter_context(tempfile.TemporaryDirectory()), "linear.pdf"
+        )
+        if self.run_engine_step(
+            context, engine.create_linearized, rfile.mimetype, output_path
+        ):
+            with open(output_path, "rb") as stream:
+                self.add_derived_file(
+                    identity,
+                    record,
+                    file_key,
+                    "linearized",
+                    "linear.pdf",
+                    stream,
+                    params_key,
+                )
+            cache.set(
+                rfile.checksum,
+                self.get_derived_file_instance(record, file_key, "linear.pdf"),
+                "linearized",
+            )
+
+    def create_derivatives(self, identity, id_, file_key, record):
+        """Create the thumbnail and the fulltext of a given file.
+
+        The existing derived files are replaced. They are taken from the
+        derivative cache if the same file has already been derived with the
+        same parameters. The files which are not on a local file system are
+        read through the storage interface.
+
+        :param identity: flask principal Identity
+        :param id_: str - record file id.
+        :param file_key: str - file key in the file record.
+        :param record: obj - record instance.
+        """
+        file_record = record.files[file_key]
+        rfile = file_record.file
+        engine = self.get_engine(rfile.mimetype)
+        steps = [
+            ("thumbnail", self.create_thumbnail, "Thumbnail creation"),
+            ("fulltext", self.create_fulltext, "Fulltext extraction"),
+            ("linearized", self.create_linearized, "PDF linearization"),
+        ]
+        errors = []
+        # the file is read from the storage and parsed at most once
+        with DerivationContext(file_record) as context:
+            for file_type, create, label in steps:
+                if not engine or not getattr(engine, file_type):
+                    continue
+                try:
+                    with self.measure(
+                        file_type, rfile.mimetype, rfile.size
+                    ) as measurement:
+                        try:
+                            create(identity, record, file_key, context)
+                        finally:
+                            if context.is_parsed:
+                                measurement.page_count = context.page_count
+                        measurement.output_bytes = sum(
+                            record.files[key].file.size
+                            for key in self.get_derived_keys(
+                                record, file_key, file_type
+                            )
+                        )
+                except Exception as error:
+                    errors.append(f"{file_type}: {error}")
+                    current_app.logger.warning(
+                        f"{label} failed for {file_key}", exc_info=True
+                    )
+        self.set_derivation_status(
+            record, file_key, "failed" if errors else "done", "; ".join(errors)
+        )
 
     def commit_file(self, identity, id_, file_key, record):
         """Commit file handler.
 
+        The derived files are created directly or, if
+        ``RERO_FILES_DERIVATION_ASYNC`` is set or the derivation engine is
+        expensive, by a background task sent to the queue of the engine cost
+        class.
+
         :param identity: flask principal Identity
         :param id_: str - record file id.
         :param file_key: str - file key in the file record.
         :param record: obj - record instance.
         """
-        # already a thumbnail
-        if record.files[file_key].get("metadata", {}).get("type") == "thumbnail":
+        # already a derived file
+        if record.files[file_key].get("metadata", {}).get("type") in self.derived_types:
             return
-        rfile = record.files[file_key].file
-        sf = self.service
-        recid = record.pid.pid_value
-        # thumbnail
-        with contextlib.suppress(Exception):
-            if blob := self.create_thumbnail_from_file(rfile.uri, rfile.mimetype):
-                thumb_name = self.change_filename_extension(file_key, "jpg")
-                sf.init_files(
-                    identity=identity,
-                    id_=recid,
-                    data=[
-                        {
-                            "key": thumb_name,
-                            "type": "thumbnail",
-                            "thumbnail_for": file_key,
-                        }
-                    ],
-                    uow=self.uow,
-                )
-                sf.set_file_content(
-                    identity,
-                    id_=recid,
-                    file_key=thumb_name,
-                    stream=BytesIO(blob),
-                    uow=self.uow,
-                )
-                sf.commit_file(
-                    identity=identity, id_=recid, file_key=thumb_name, uow=self.uow
-                )
-        # fulltext
-        with contextlib.suppress(Exception):
-            if fulltext := self.create_fulltext_from_file(rfile.uri, rfile.mimetype):
-                thumb_name = self.change_filename_extension(file_key, "txt")
-                sf.init_files(
-                    identity=identity,
-                    id_=recid,
-                    data=[
-                        {
-                            "key": thumb_name,
-                            "type": "fulltext",
-                            "fulltext_for": file_key,
-                        }
-                    ],
-                    uow=self.uow,
-                )
-                sf.set_file_content(
-                    identity=identity,
-                    id_=recid,
-                    file_key=thumb_name,
-                    stream=BytesIO(fulltext.encode()),
-                    uow=self.uow,
-                )
-                sf.commit_file(
-                    identity=identity, id_=recid, file_key=thumb_name, uow=self.uow
-                )
+        if not (engine := self.get_engine(record.files[file_key].file.mimetype)):
+            return
+        if (
+            current_app.config.get("RERO_FILES_DERIVATION_ASYNC")
+            or engine.cost == "expensive"
+        ):
+            self.set_derivation_status(record, file_key, "pending")
+            service_id = current_service_registry.get_service_id(self.service)
+            task = create_derivatives.s(service_id, record.pid.pid_value, file_key)
+            if queue := current_app.config["RERO_FILES_DERIVATION_QUEUES"].get(
+                engine.cost
+            ):
+                task = task.set(queue=queue)
+            self.uow.register(TaskOp(task))
+        else:
+            self.create_derivatives(identity, id_, file_key, record)
 
     def delete_file(self, identity, id_, file_key, record, deleted_file):
         """Delete file handler.
@@ -177,18 +838,16 @@ class ThumbnailAndFulltextComponent(FileServiceComponent):
         :param record: obj - record instance.
         :param deleted_file: file instance - the deleted file instance.
         """
-        # a thumbnail or a fulltext
-        if deleted_file.get("metadata", {}).get("type") in ["thumbnail", "fulltext"]:
+        # a thumbnail, a fulltext or a linearized copy
+        if deleted_file.get("metadata", {}).get("type") in self.derived_types:
             return
         sf = self.service
         recid = record.pid.pid_value
-        thumb_name = self.change_filename_extension(file_key, "jpg")
-        with contextlib.suppress(FileKeyNotFoundError):
-            sf.delete_file(
-                identity=identity, id_=recid, file_key=thumb_name, uow=self.uow
-            )
-        fulltext_name = self.change_filename_extension(file_key, "txt")
-        with contextlib.suppress(FileKeyNotFoundError):
-            sf.delete_file(
-                identity=identity, id_=recid, file_key=fulltext_name, uow=self.uow
-            )
+        for file_type in self.derived_types:
+            for key in self.get_derived_keys(record, file_key, file_type):
+                with contextlib.suppress(FileKeyNotFoundError):
+                    sf.delete_file(
+                        identity=identity, id_=recid, file_key=key, uow=self.uow
+                    )
+                    if file_type == "fulltext":
+                        self.index_record(record)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Search dumpers extensions."""
+
+import codecs
+from bisect import bisect_right
+
+from flask import current_app
+from invenio_records.dumpers import SearchDumperExt
+
+from .pages import PagedText
+
+
+class FulltextDumperExt(SearchDumperExt):
+    """Add the fulltext of the record files to the search document.
+
+    The fulltext is split into chunks to keep each indexed value small and
+    truncated to ``RERO_FILES_FULLTEXT_INDEX_MAX_SIZE`` bytes to bound the
+    size of the bulk index requests. The chunks are made of whole pages,
+    using the page index of the fulltext: a search hit can be mapped back to
+    its pages.
+    """
+
+    def __init__(self, key="fulltext"):
+        """Constructor.
+
+        :param key: str - the search document field name.
+        """
+        self.key = key
+
+    @staticmethod
+    def iter_page_chunks(file_record, index_record, chunk_size, max_size):
+        """Read the text of a file by chunks of pages.
+
+        The consecutive pages are merged up to the chunk size, a larger page
+        is split on a white space.
+
+        :param file_record: FileRecord - the fulltext file record.
+        :param index_record: FileRecord - the page index file record.
+        :param chunk_size: int - the maximal size of the chunks in bytes.
+        :param max_size: int - the maximal number of bytes to read.
+        :returns: a generator of str.
+        """
+        with file_record.open_stream("rb") as text_stream:
+            with index_record.open_stream("rb") as index_stream:
+                paged_text = PagedText(text_stream, index_stream)
+            offsets = paged_text.offsets
+            end = min(offsets[-1], max_size)
+            start = 0
+            while start < end:
+                # the last page starting in the chunk
+                stop = min(offsets[bisect_right(offsets, start + chunk_size) - 1], end)
+                if stop > start:
+                    text = paged_text.read(start, stop)
+                else:
+                    stop = min(start + chunk_size, end)
+                    text = paged_text.read(start, stop)
+                    # not in the middle of a word or a character
+                    if stop < end and text:
+                        if (cut := text.rfind(" ") + 1) > 0:
+                            text = text[:cut]
+                        stop = start + len(text.encode())
+                if text:
+                    yield text
+                start = stop
+
+    @staticmethod
+    def iter_chunks(file_record, chunk_size, max_size):
+        """Read the text of a file without page index by chunks.
+
+        :param file_record: FileRecord - the fulltext file record.
+        :param chunk_size: int - the size of the chunks in bytes.
+        :param max_size: int - the maximal number of bytes to read.
+        :returns: a generator of str.
+        """
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        with file_record.open_stream("rb") as fp:
+            while max_size > 0 and (chunk := fp.read(min(chunk_size, max_size))):
+                max_size -= len(chunk)
+                if text := decoder.decode(chunk):
+                    yield text
+
+    def dump(self, record, data):
+        """Dump the fulltext files content."""
+        # records without files
+        if (files := getattr(record, "files", None)) is None:
+            return
+        max_size = current_app.config["RERO_FILES_FULLTEXT_INDEX_MAX_SIZE"]
+        chunk_size = current_app.config["RERO_FILES_FULLTEXT_INDEX_CHUNK_SIZE"]
+        chunks = []
+        # the files are read from the database as the files of the record
+        # instance can be outdated
+        file_records = list(files.file_cls.list_by_record(record.id))
+        index_records = {
+            metadata["pages_for"]: file_record
+            for file_record in file_records
+            if (metadata := file_record.metadata or {}).get("type") == "pages"
+        }
+        for file_record in file_records:
+            metadata = file_record.metadata or {}
+            if metadata.get("type") != "fulltext":
+                continue
+            if index_record := index_records.get(metadata.get("fulltext_for")):
+                file_chunks = self.iter_page_chunks(
+                    file_record, index_record, chunk_size, max_size
+                )
+            else:
+                file_chunks = self.iter_chunks(file_record, chunk_size, max_size)
+            for chunk in file_chunks:
+                max_size -= len(chunk.encode())
+                chunks.append(chunk)
+        if chunks:
+            data[self.key] = chunks
+
+    def load(self, data, record_cls):
+        """Remove the fulltext from the search document."""
+        data.pop(self.key, None)
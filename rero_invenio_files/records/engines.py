@@ -0,0 +1,644 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Derivation engines creating the thumbnails and the fulltexts."""
+
+import contextlib
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import fnmatch
+from functools import lru_cache
+from itertools import islice
+
+import fitz
+from flask import current_app
+from wand.color import Color
+from wand.image import Image
+from wand.resource import limits
+from wand.version import formats as wand_formats
+
+from ..pdf import LINEARIZE_OPTIONS
+from .pages import PAGE_BREAK, PageNotFoundError
+
+
+def extract_pages_text(file_path, start, stop):
+    """Extract the text of a range of pages of a pdf file.
+
+    :param file_path: str - the path of the file.
+    :param start: int - the first page number.
+    :param stop: int - the page number to stop to (excluded).
+    :returns: the utf-8 encoded text, the pages are separated by a page
+        break.
+    """
+    with fitz.open(file_path) as pdf_file:
+        return PAGE_BREAK.join(
+            get_page_text(pdf_file[number]) for number in range(start, stop)
+        )
+
+
+def get_page_text(page):
+    """Extract the text of a page.
+
+    :param page: Page - the PyMuPDF page.
+    :returns: the utf-8 encoded text, without page break.
+    """
+    return page.get_text("text").encode().replace(PAGE_BREAK, b" ")
+
+
+def open_pdf(file_path, document=None):
+    """Open a pdf file unless it is already open.
+
+    :param file_path: str - the path of the file.
+    :param document: Document - an already open document, kept open.
+    :returns: a context manager of the document.
+    """
+    if document is not None:
+        return contextlib.nullcontext(document)
+    return fitz.open(file_path)
+
+
+@contextlib.contextmanager
+def image_resource_limits(memory_limit=None, time_limit=None):
+    """Limit the resources used by ImageMagick in the current process.
+
+    The pixel cache memory, memory map and disk are limited to the given
+    size, a larger image raises an exception instead of being decoded. A
+    longer processing is aborted after the time limit.
+
+    :param memory_limit: int - the maximal size in bytes, None for no limit.
+    :param time_limit: int - the maximal duration in seconds, None for no
+        limit.
+    """
+    values = {}
+    if memory_limit:
+        values.update(memory=memory_limit, map=memory_limit, disk=memory_limit)
+    if time_limit:
+        values["time"] = math.ceil(time_limit)
+    if not values:
+        yield
+        return
+    previous = {name: limits[name] for name in values}
+    for name, value in values.items():
+        limits[name] = value
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            limits[name] = value
+
+
+@lru_cache
+def is_image_format_supported(image_format):
+    """Check if the ImageMagick build can write a given image format.
+
+    :param image_format: str - the image format such as webp.
+    :returns: True if the format is supported.
+    """
+    return bool(wand_formats(image_format.upper()))
+
+
+class DerivationEngine:
+    """Create the derived files of some file types.
+
+    The engines declare the mime types they support, the derived files they
+    create and their cost class: ``cheap`` engines run when the file is
+    committed, ``expensive`` ones always run in a background task.
+    """
+
+    name = None
+    """Engine name."""
+
+    mimetypes = []
+    """Supported mime types, ``fnmatch`` patterns such as ``image/*``."""
+
+    cost = "cheap"
+    """Cost class: cheap or expensive."""
+
+    thumbnail = False
+    """The engine creates thumbnails."""
+
+    fulltext = False
+    """The engine extracts a fulltext."""
+
+    linearized = False
+    """The engine creates a linearized copy of the PDF files."""
+
+    page_images = False
+    """The engine renders the pages on demand."""
+
+    @property
+    def pages(self):
+        """The engine extracts the page index of the fulltext."""
+        return self.fulltext
+
+    def match(self, mimetype):
+        """Check if a mime type is supported.
+
+        :param mimetype: str - the mime type of the file.
+        :returns: True if the engine supports the mime type.
+        """
+        return any(fnmatch(mimetype, pattern) for pattern in self.mimetypes)
+
+    def create_thumbnails(self, context, mimetype, renditions):
+        """Create the thumbnails of a file.
+
+        :param context: DerivationContext - the file to derive.
+        :param mimetype: str - the mime type of the file.
+        :param renditions: list of dict - the thumbnail renditions.
+        :returns: the list of binary data in the renditions order.
+        """
+        raise NotImplementedError()
+
+    def iter_fulltext(self, context, mimetype):
+        """Extract the fulltext of a file.
+
+        :param context: DerivationContext - the file to derive.
+        :param mimetype: str - the mime type of the file.
+        :returns: a generator of utf-8 encoded text chunks, the pages are
+            separated by a ``PAGE_BREAK``.
+        """
+        raise NotImplementedError()
+
+    def render_page(self, context, mimetype, number, width, quality):
+        """Render a page of a file as a JPEG image.
+
+        :param context: DerivationContext - the file to derive.
+        :param mimetype: str - the mime type of the file.
+        :param number: int - the page number, from 1.
+        :param width: int - the image width in pixels.
+        :param quality: int - the JPEG quality.
+        :returns: the JPEG binary data.
+        """
+        raise NotImplementedError()
+
+    def create_linearized(self, context, mimetype, output_path):
+        """Create a linearized copy of a PDF file.
+
+        :param context: DerivationContext - the file to derive.
+        :param mimetype: str - the mime type of the file.
+        :param output_path: str - the path of the linearized copy.
+        :returns: True if a copy has been created.
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    def encode_image(img, image_format, quality, max_distortion=None):
+        """Encode an image in a given format.
+
+        With a maximal distortion, the image is encoded with decreasing
+        qualities and the smallest encoding whose root mean square distortion
+        stays under the given value is kept.
+
+        :param img: Image - the wand image.
+        :param image_format: str - the image format such as jpg or webp.
+        :param quality: int - the encoding quality, the maximal one with a
+            maximal distortion.
+        :param max_distortion: float - the maximal normalized distortion.
+        :returns: the binary data.
+        """
+        best = None
+        for current_quality in range(quality, 0, -10) if max_distortion else [quality]:
+            with img.clone() as encoded:
+                encoded.format = image_format
+                encoded.compression_quality = current_quality
+                blob = encoded.make_blob()
+            if best is not None:
+                with Image(blob=blob) as decoded:
+                    difference, distortion = img.compare(
+                        decoded, metric="root_mean_square"
+                    )
+                    difference.close()
+                if distortion > max_distortion:
+                    break
+            if best is None or len(blob) < len(best):
+                best = blob
+        return best
+
+    @classmethod
+    def encode_renditions(cls, renditions, thumbnails, size, to_image, to_jpg=None):
+        """Encode all the renditions of a given size.
+
+        :param renditions: list of dict - the thumbnail renditions.
+        :param thumbnails: list - the binary data in the renditions order,
+            updated in place.
+        :param size: int - the size of the renditions to encode.
+        :param to_image: callable - returns a wand image context manager of
+            the given size.
+        :param to_jpg: callable - returns the jpg encoding for a given
+            quality, if it is cheaper than a wand encoding.
+        """
+        for index, rendition in enumerate(renditions):
+            if rendition["size"] != size:
+                continue
+            image_format = rendition.get("format", "jpg")
+            max_distortion = rendition.get("max_distortion")
+            if to_jpg and image_format == "jpg" and not max_distortion:
+                thumbnails[index] = to_jpg(rendition["quality"])
+                continue
+            with to_image() as img:
+                thumbnails[index] = cls.encode_image(
+                    img, image_format, rendition["quality"], max_distortion
+                )
+
+
+class DocumentEngine(DerivationEngine):
+    """PDF and other documents supported by PyMuPDF such as EPUB."""
+
+    name = "document"
+    mimetypes = [
+        "application/pdf",
+        "application/epub+zip",
+        "application/x-fictionbook+xml",
+        "application/vnd.ms-xpsdocument",
+        "application/oxps",
+    ]
+    thumbnail = True
+    fulltext = True
+    page_images = True
+
+    @property
+    def linearized(self):
+        """The PDF files are linearized if it is configured."""
+        return current_app.config["RERO_FILES_PDF_LINEARIZE"]
+
+    def create_thumbnails(self, context, mimetype, renditions):
+        """Create the thumbnails of the first page."""
+        return self.create_thumbnails_from_document(context.document, renditions)
+
+    def render_page(self, context, mimetype, number, width, quality):
+        """Render a page using PyMuPDF."""
+        return self.render_page_from_document(context.document, number, width, quality)
+
+    def create_linearized(self, context, mimetype, output_path):
+        """Save a linearized copy of the PDF files not linearized yet.
+
+        This is the last derivation step, as the garbage collection changes
+        the open document.
+        """
+        if mimetype != "application/pdf" or context.document.is_fast_webaccess:
+            return False
+        context.document.save(output_path, **LINEARIZE_OPTIONS)
+        return True
+
+    def iter_fulltext(self, context, mimetype):
+        """Extract the text page by page, in parallel for large PDFs."""
+        processes = current_app.config["RERO_FILES_FULLTEXT_PROCESSES"]
+        if mimetype == "application/pdf" and processes > 1:
+            return self.iter_fulltext_from_file(
+                context.path,
+                processes=processes,
+                parallel_min_pages=current_app.config[
+                    "RERO_FILES_FULLTEXT_PARALLEL_MIN_PAGES"
+                ],
+                document=context.document,
+            )
+        return self.iter_fulltext_from_document(context.document)
+
+    @classmethod
+    def create_thumbnails_from_document(cls, document, renditions):
+        """Create thumbnails of the first page of a document.
+
+        :param document: Document - the open PyMuPDF document.
+        :param renditions: list of dict - the thumbnail renditions.
+        :returns: the list of binary data in the renditions order.
+        """
+        sizes = sorted({rendition["size"] for rendition in renditions}, reverse=True)
+        thumbnails = [None] * len(renditions)
+        page = document[0]
+        scale_factor = min(sizes[0] / page.rect.width, sizes[0] / page.rect.height)
+        largest = page.get_pixmap(matrix=fitz.Matrix(scale_factor, scale_factor))
+        for size in sizes:
+            pixmap = largest
+            if size != sizes[0]:
+                ratio = size / sizes[0]
+                pixmap = fitz.Pixmap(
+                    largest,
+                    max(round(largest.width * ratio), 1),
+                    max(round(largest.height * ratio), 1),
+                    None,
+                )
+            cls.encode_renditions(
+                renditions,
+                thumbnails,
+                size,
+                lambda: Image(blob=pixmap.tobytes(output="png")),
+                lambda quality: pixmap.tobytes(output="jpg", jpg_quality=quality),
+            )
+        return thumbnails
+
+    @staticmethod
+    def render_page_from_document(document, number, width, quality):
+        """Render a page of a document as a JPEG image.
+
+        :param document: Document - the open PyMuPDF document.
+        :param number: int - the page number, from 1.
+        :param width: int - the image width in pixels.
+        :param quality: int - the JPEG quality.
+        :returns: the JPEG binary data.
+        :raises PageNotFoundError: if the page does not exist.
+        """
+        if not 1 <= number <= document.page_count:
+            raise PageNotFoundError(f"page {number} out of range")
+        page = document[number - 1]
+        zoom = width / page.rect.width
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        return pixmap.tobytes(output="jpg", jpg_quality=quality)
+
+    @classmethod
+    def iter_fulltext_from_file(
+        cls, file_path, processes=1, parallel_min_pages=0, document=None
+    ):
+        """Extract the fulltext page by page for a given pdf file.
+
+        Only one page is extracted at a time, the pages are separated by a
+        page break. Large documents can be processed by several processes.
+
+        :param file_path: str - the path of the file.
+        :param processes: int - the number of processes to use.
+        :param parallel_min_pages: int - the minimal number of pages to use
+            several processes.
+        :param document: Document - the already open pdf document.
+        :returns: a generator of utf-8 encoded text chunks.
+        """
+        with open_pdf(file_path, document) as pdf_file:
+            page_count = pdf_file.page_count
+            if processes <= 1 or page_count < parallel_min_pages:
+                yield from cls.iter_fulltext_from_document(pdf_file)
+                return
+        yield from cls.iter_fulltext_in_parallel(file_path, page_count, processes)
+
+    @staticmethod
+    def iter_fulltext_from_document(document):
+        """Extract the fulltext of a document page by page.
+
+        :param document: Document - the open PyMuPDF document.
+        :returns: a generator of utf-8 encoded text chunks, the pages are
+            separated by a page break.
+        """
+        for page in document:
+            if page.number:
+                yield PAGE_BREAK
+            yield get_page_text(page)
+
+    @staticmethod
+    def iter_fulltext_in_parallel(file_path, page_count, processes):
+        """Extract the fulltext of a pdf file using a pool of processes.
+
+        The pages are split into ranges, each range is extracted by a worker
+        process and the texts are returned in the page order. The number of
+        pending ranges is bounded to keep the memory footprint low.
+
+        :param file_path: str - the path of the file.
+        :param page_count: int - the number of pages of the pdf file.
+        :param processes: int - the number of processes to use.
+        :returns: a generator of utf-8 encoded text chunks.
+        """
+        step = math.ceil(page_count / (processes * 4))
+        starts = iter(range(0, page_count, step))
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+
+            def submit(start):
+                return start, executor.submit(
+                    extract_pages_text,
+                    file_path,
+                    start,
+                    min(start + step, page_count),
+                )
+
+            pending = deque(submit(start) for start in islice(starts, processes * 2))
+            while pending:
+                start, future = pending.popleft()
+                if (next_start := next(starts, None)) is not None:
+                    pending.append(submit(next_start))
+                if start:
+                    yield PAGE_BREAK
+                yield future.result()
+
+
+class ImageEngine(DerivationEngine):
+    """Raster images decoded by ImageMagick."""
+
+    name = "image"
+    mimetypes = ["image/*"]
+    thumbnail = True
+
+    def create_thumbnails(self, context, mimetype, renditions):
+        """Create the thumbnails of the first frame."""
+        return self.create_thumbnails_from_image(
+            context.path,
+            renditions,
+            max_pixels=current_app.config["RERO_FILES_THUMBNAIL_MAX_PIXELS"],
+            memory_limit=current_app.config["RERO_FILES_THUMBNAIL_MEMORY_LIMIT"],
+            time_limit=current_app.config["RERO_FILES_DERIVATION_TIMEOUT"],
+        )
+
+    @classmethod
+    def create_thumbnails_from_image(
+        cls, file_path, renditions, max_pixels=None, memory_limit=None, time_limit=None
+    ):
+        """Create thumbnails of the first frame of an image.
+
+        :param file_path: Full path of file.
+        :param renditions: list of dict - the thumbnail renditions.
+        :param max_pixels: int - the maximal number of decoded pixels.
+        :param memory_limit: int - the maximal memory in bytes used to
+            decode the image.
+        :param time_limit: int - the maximal duration in seconds of the
+            image processing.
+        :returns: the list of binary data in the renditions order.
+        """
+        sizes = sorted({rendition["size"] for rendition in renditions}, reverse=True)
+        thumbnails = [None] * len(renditions)
+        filename = f"{file_path}[0]"
+        with Image.ping(filename=filename) as info:
+            width, height, image_format = info.width, info.height, info.format
+        # JPEG images can be scaled down by 8 while decoding
+        shrink = 1
+        if image_format == "JPEG":
+            while shrink < 8 and min(width, height) // (shrink * 2) >= sizes[0]:
+                shrink *= 2
+        if max_pixels and (width // shrink) * (height // shrink) > max_pixels:
+            raise ValueError(f"Image too large to decode: {width}x{height}")
+        with image_resource_limits(memory_limit, time_limit), Image() as img:
+            if image_format == "JPEG":
+                img.options["jpeg:size"] = f"{sizes[0]}x{sizes[0]}"
+            img.read(filename=filename)
+            img.background_color = Color("white")
+            img.alpha_channel = "remove"
+            for size in sizes:
+                img.transform(resize=f"{size}x")
+                cls.encode_renditions(renditions, thumbnails, size, img.clone)
+        return thumbnails
+
+
+class TextEngine(DerivationEngine):
+    """Plain text files indexed as they are."""
+
+    name = "text"
+    mimetypes = ["text/plain", "text/markdown"]
+    fulltext = True
+
+    def iter_fulltext(self, context, mimetype):
+        """Read the text, invalid utf-8 characters are replaced.
+
+        The form feeds of the text are page breaks.
+        """
+        with open(context.path, encoding="utf-8", errors="replace") as text_file:
+            while chunk := text_file.read(64 * 1024):
+                yield chunk.encode()
+
+
+def run_command(args):
+    """Run an external conversion command.
+
+    :param args: list - the command and its arguments.
+    :raises subprocess.CalledProcessError: if the command fails.
+    :raises subprocess.TimeoutExpired: if the command takes too long.
+    """
+    subprocess.run(
+        args,
+        check=True,
+        capture_output=True,
+        timeout=current_app.config["RERO_FILES_DERIVATION_COMMAND_TIMEOUT"],
+    )
+
+
+class OfficeEngine(DerivationEngine):
+    """Office documents converted to PDF by LibreOffice."""
+
+    name = "office"
+    mimetypes = [
+        "application/msword",
+        "application/rtf",
+        "application/vnd.ms-excel",
+        "application/vnd.ms-powerpoint",
+        "application/vnd.oasis.opendocument.*",
+        "application/vnd.openxmlformats-officedocument.*",
+    ]
+    cost = "expensive"
+    thumbnail = True
+    fulltext = True
+    command = "soffice"
+    """LibreOffice executable."""
+
+    def get_pdf(self, context):
+        """Convert the document to PDF once per derivation.
+
+        :param context: DerivationContext - the file to derive.
+        :returns: the open PDF document.
+        """
+        if "pdf" not in context.extras:
+            out_dir = context.enter_context(tempfile.TemporaryDirectory())
+            run_command(
+                [
+                    shutil.which(self.command) or self.command,
+                    "--headless",
+                    "--convert-to",
+                    "pdf",
+                    "--outdir",
+                    out_dir,
+                    context.path,
+                ]
+            )
+            basename, _ = os.path.splitext(os.path.basename(context.path))
+            context.extras["pdf"] = context.enter_context(
+                fitz.open(os.path.join(out_dir, f"{basename}.pdf"))
+            )
+        return context.extras["pdf"]
+
+    def create_thumbnails(self, context, mimetype, renditions):
+        """Create the thumbnails of the first page."""
+        return DocumentEngine.create_thumbnails_from_document(
+            self.get_pdf(context), renditions
+        )
+
+    def iter_fulltext(self, context, mimetype):
+        """Extract the text of the converted document."""
+        return DocumentEngine.iter_fulltext_from_document(self.get_pdf(context))
+
+
+class FFmpegEngine(DerivationEngine):
+    """Video frame grabs and audio waveforms created by ffmpeg."""
+
+    name = "ffmpeg"
+    mimetypes = ["video/*", "audio/*"]
+    cost = "expensive"
+    thumbnail = True
+    command = "ffmpeg"
+    """ffmpeg executable."""
+
+    def create_thumbnails(self, context, mimetype, renditions):
+        """Create the thumbnails of a representative frame or the waveform."""
+        size = max(rendition["size"] for rendition in renditions)
+        if mimetype.startswith("audio/"):
+            video_filter = ["-filter_complex", f"showwavespic=s={size}x{size // 2}"]
+        else:
+            # the most representative frame of the first ones
+            video_filter = ["-vf", "thumbnail"]
+        with tempfile.TemporaryDirectory() as out_dir:
+            frame_path = os.path.join(out_dir, "frame.png")
+            run_command(
+                [
+                    shutil.which(self.command) or self.command,
+                    "-v",
+                    "error",
+                    "-i",
+                    context.path,
+                    *video_filter,
+                    "-frames:v",
+                    "1",
+                    frame_path,
+                ]
+            )
+            return ImageEngine.create_thumbnails_from_image(frame_path, renditions)
+
+
+class DerivationEngineRegistry:
+    """Derivation engines by mime type."""
+
+    def __init__(self):
+        """Constructor."""
+        self._engines = []
+
+    def register(self, engine):
+        """Register an engine, the first registered engines take precedence.
+
+        :param engine: DerivationEngine - the engine instance.
+        """
+        self._engines.append(engine)
+
+    def get(self, mimetype):
+        """Get the engine of a mime type.
+
+        :param mimetype: str - the mime type of the file.
+        :returns: the first engine supporting the mime type or None.
+        """
+        if not mimetype:
+            return
+        return next(
+            (engine for engine in self._engines if engine.match(mimetype)), None
+        )
+
+    def __iter__(self):
+        """Iterate over the registered engines."""
+        return iter(self._engines)
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Instrumentation of the derivations."""
+
+import contextlib
+
+
+class Measurement:
+    """Measure of a derivation step of a record file."""
+
+    def __init__(self, step, mimetype, input_bytes=None):
+        """Constructor.
+
+        :param step: str - the derivation step, thumbnail or fulltext.
+        :param mimetype: str - the mime type of the original file.
+        :param input_bytes: int - the size of the original file.
+        """
+        self.step = step
+        self.mimetype = mimetype
+        self.input_bytes = input_bytes
+        self.output_bytes = None
+        self.page_count = None
+        self.duration = None
+        self.error = None
+        self.error_type = None
+
+    @property
+    def status(self):
+        """Status of the step, done or failed."""
+        return "failed" if self.error_type else "done"
+
+    def attributes(self):
+        """Attributes of the measure, without the undefined values.
+
+        :returns: a dict of the attributes.
+        """
+        attributes = dict(
+            step=self.step,
+            mimetype=self.mimetype,
+            status=self.status,
+            input_bytes=self.input_bytes,
+            output_bytes=self.output_bytes,
+            page_count=self.page_count,
+            duration=self.duration,
+            error=self.error,
+            error_type=self.error_type,
+        )
+        return {key: value for key, value in attributes.items() if value is not None}
+
+
+class DerivationInstrumentation:
+    """Instrumentation of the derivations, which does nothing.
+
+    The subclasses override ``record`` to collect the finished measurements
+    or ``measure`` to wrap the steps, in a trace span for example.
+    """
+
+    @contextlib.contextmanager
+    def measure(self, measurement):
+        """Wrap a derivation step.
+
+        The measurement is complete when the step is finished.
+
+        :param measurement: Measurement - the measure of the step.
+        """
+        try:
+            yield measurement
+        finally:
+            self.record(measurement)
+
+    def record(self, measurement):
+        """Collect a finished measurement.
+
+        :param measurement: Measurement - the measure of the step.
+        """
+
+
+class InMemoryInstrumentation(DerivationInstrumentation):
+    """Keep the measurements in memory, for the tests."""
+
+    def __init__(self):
+        """Constructor."""
+        self.measurements = []
+
+    def record(self, measurement):
+        """Collect a finished measurement.
+
+        :param measurement: Measurement - the measure of the step.
+        """
+        self.measurements.append(measurement)
+
+    def clear(self):
+        """Remove the collected measurements."""
+        self.measurements.clear()
+
+
+class PrometheusInstrumentation(DerivationInstrumentation):
+    """Prometheus metrics labelled by step and mime type.
+
+    Requires ``prometheus_client``, the metrics are exposed by the
+    application like its other metrics.
+    """
+
+    metrics = {}
+    """Metrics by registry, a metric is registered only once."""
+
+    def __init__(self, registry=None):
+        """Constructor.
+
+        :param registry: CollectorRegistry - the registry of the metrics,
+            the default one if not given.
+        """
+        from prometheus_client import REGISTRY, Counter, Histogram
+
+        registry = registry or REGISTRY
+        if registry not in self.metrics:
+            labels = ["step", "mimetype"]
+            size_buckets = [4**exponent * 1024 for exponent in range(10)]
+            self.metrics[registry] = dict(
+                duration=Histogram(
+                    "rero_files_derivation_duration_seconds",
+                    "Duration of the derivation steps.",
+                    labels + ["status"],
+                    registry=registry,
+                ),
+                input_bytes=Histogram(
+                    "rero_files_derivation_input_bytes",
+                    "Size of the derived files.",
+                    labels,
+                    buckets=size_buckets,
+                    registry=registry,
+                ),
+                output_bytes=Histogram(
+                    "rero_files_derivation_output_bytes",
+                    "Size of the derived files created.",
+                    labels,
+                    buckets=size_buckets,
+                    registry=registry,
+                ),
+                page_count=Histogram(
+                    "rero_files_derivation_pages",
+                    "Number of pages of the derived documents.",
+                    labels,
+                    buckets=[1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000],
+                    registry=registry,
+                ),
+                failures=Counter(
+                    "rero_files_derivation_failures",
+                    "Number of failed derivation steps.",
+                    labels + ["reason"],
+                    registry=registry,
+                ),
+            )
+        self._metrics = self.metrics[registry]
+
+    def record(self, measurement):
+        """Update the metrics.
+
+        :param measurement: Measurement - the measure of the step.
+        """
+        labels = dict(step=measurement.step, mimetype=measurement.mimetype)
+        self._metrics["duration"].labels(status=measurement.status, **labels).observe(
+            measurement.duration
+        )
+        for name in ["input_bytes", "output_bytes", "page_count"]:
+            if (value := getattr(measurement, name)) is not None:
+                self._metrics[name].labels(**labels).observe(value)
+        if measurement.error_type:
+            # the exception class keeps the number of label values bounded
+            self._metrics["failures"].labels(
+                reason=measurement.error_type, **labels
+            ).inc()
+
+
+class OpenTelemetryInstrumentation(DerivationInstrumentation):
+    """OpenTelemetry span for each derivation step.
+
+    Requires ``opentelemetry-api``, the spans are exported by the tracer
+    provider configured by the application.
+    """
+
+    def __init__(self, tracer=None):
+        """Constructor.
+
+        :param tracer: Tracer - the tracer creating the spans.
+        """
+        from opentelemetry import trace
+
+        self.trace = trace
+        self.tracer = tracer or trace.get_tracer(__name__)
+
+    @contextlib.contextmanager
+    def measure(self, measurement):
+        """Wrap a derivation step in a span.
+
+        :param measurement: Measurement - the measure of the step.
+        """
+        with self.tracer.start_as_current_span(
+            f"rero_files.derivation.{measurement.step}",
+            record_exception=True,
+            set_status_on_exception=True,
+        ) as span:
+            try:
+                yield measurement
+            finally:
+                span.set_attributes(
+                    {
+                        f"rero_files.{key}": value
+                        for key, value in measurement.attributes().items()
+                    }
+                )
+                self.record(measurement)
@@ -17,9 +17,10 @@
 
 """Files support for the RERO invenio instances."""
 from invenio_db import db
-from invenio_files_rest.models import Bucket
+from invenio_files_rest.models import Bucket, FileInstance
 from invenio_records.models import RecordMetadataBase
 from invenio_records_resources.records.models import FileRecordModelMixin
+from sqlalchemy_utils.models import Timestamp
 from sqlalchemy_utils.types import UUIDType
 
 
@@ -36,3 +37,22 @@ class FileRecordMetadata(db.Model, RecordMetadataBase, FileRecordModelMixin):
 
     __tablename__ = "objects_files"
     __record_model_cls__ = RecordMetadata
+
+
+class DerivativeCacheMetadata(db.Model, Timestamp):
+    """Model for the derived files cache.
+
+    A derived file is identified by the checksum of the original file and the
+    derivation parameters, the ``updated`` column is the last access time,
+    updated at most once per ``DerivativeCache.touch_interval``. The table is
+    created by ``invenio db create``, also on an existing database.
+    """
+
+    __tablename__ = "objects_derivatives_cache"
+    checksum = db.Column(db.String(255), primary_key=True)
+    params = db.Column(db.String(255), primary_key=True)
+    file_id = db.Column(
+        UUIDType, db.ForeignKey(FileInstance.id, ondelete="CASCADE"), nullable=False
+    )
+    file = db.relationship(FileInstance)
+    hits = db.Column(db.Integer, nullable=False, default=0)
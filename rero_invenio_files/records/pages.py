@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Page index of the fulltexts."""
+
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+
+PAGE_BREAK = b"\f"
+"""Page separator of the extracted text, replaced by a new line when stored."""
+
+
+class PageNotFoundError(IndexError):
+    """The page does not exist in the file."""
+
+
+class PageIndexer:
+    """Build the page index of an extracted text.
+
+    The page breaks of the text chunks are replaced by new lines, the index
+    contains the byte offset of each page in the stored text followed by the
+    text size, encoded as little-endian 64 bits integers.
+    """
+
+    def __init__(self, chunks):
+        """Constructor.
+
+        :param chunks: iterable - the text bytes chunks, the pages separated
+            by ``PAGE_BREAK``.
+        """
+        self.chunks = chunks
+        self.offsets = [0]
+        self.size = 0
+
+    def __iter__(self):
+        """Iterate over the text chunks to store.
+
+        :returns: a generator of bytes chunks.
+        """
+        for chunk in self.chunks:
+            position = chunk.find(PAGE_BREAK)
+            while position >= 0:
+                self.offsets.append(self.size + position + 1)
+                position = chunk.find(PAGE_BREAK, position + 1)
+            self.size += len(chunk)
+            yield chunk.replace(PAGE_BREAK, b"\n")
+
+    def to_bytes(self):
+        """Encode the page index, once the text has been read.
+
+        :returns: the binary page index.
+        """
+        offsets = self.offsets + [self.size]
+        return struct.pack(f"<{len(offsets)}Q", *offsets)
+
+
+class PagedText:
+    """Random access to the pages of a stored text using its page index.
+
+    The page index is read once, a page is then read using a single seek in
+    the stored text. The pages are numbered from 1.
+    """
+
+    def __init__(self, text_stream, index_stream):
+        """Constructor.
+
+        :param text_stream: file object - the seekable stored text.
+        :param index_stream: file object - the page index.
+        """
+        self.text_stream = text_stream
+        self.offsets = array("Q", index_stream.read())
+        if sys.byteorder == "big":
+            self.offsets.byteswap()
+        self.page_count = len(self.offsets) - 1
+
+    def get_page_range(self, number):
+        """Get the byte range of a page in the stored text.
+
+        :param number: int - the page number.
+        :returns: the start and the end (excluded) offsets of the page, the
+            page separator excluded.
+        :raises PageNotFoundError: if the page does not exist.
+        """
+        if not 1 <= number <= self.page_count:
+            raise PageNotFoundError(f"page {number} out of range")
+        start, stop = self.offsets[number - 1], self.offsets[number]
+        if number < self.page_count:
+            stop -= 1
+        return start, stop
+
+    def get_page_text(self, number):
+        """Get the text of a page.
+
+        :param number: int - the page number.
+        :returns: the text of the page.
+        :raises PageNotFoundError: if the page does not exist.
+        """
+        start, stop = self.get_page_range(number)
+        return self.read(start, stop)
+
+    def find_page(self, offset):
+        """Find the page containing a given offset of the stored text.
+
+        :param offset: int - the byte offset in the stored text.
+        :returns: the page number.
+        :raises PageNotFoundError: if the offset is outside the text.
+        """
+        if not 0 <= offset < self.offsets[-1]:
+            raise PageNotFoundError(f"offset {offset} out of range")
+        # the last page starting before the offset
+        return bisect_right(self.offsets, offset, hi=self.page_count)
+
+    def get_snippet(self, offset, size=200):
+        """Get the text around a given offset, within its page.
+
+        :param offset: int - the byte offset of a hit in the stored text.
+        :param size: int - the number of bytes before and after the offset.
+        :returns: a dict of the page number, the byte range and the text.
+        :raises PageNotFoundError: if the offset is outside the text.
+        """
+        page = self.find_page(offset)
+        page_start, page_stop = self.get_page_range(page)
+        start = max(page_start, offset - size)
+        stop = min(page_stop, offset + size)
+        return dict(page=page, start=start, stop=stop, text=self.read(start, stop))
+
+    def read(self, start, stop):
+        """Read a byte range of the stored text.
+
+        The characters cut by the range limits are ignored.
+
+        :param start: int - the start offset.
+        :param stop: int - the end offset, excluded.
+        :returns: the text.
+        """
+        self.text_stream.seek(start)
+        return self.text_stream.read(stop - start).decode("utf-8", errors="ignore")
@@ -17,7 +17,23 @@
 
 """Files support for the RERO invenio instances."""
 
+import time
+from calendar import timegm
+from io import BytesIO
+from urllib.parse import quote, urlparse
 
+import marshmallow as ma
+from flask import Response, current_app, g, redirect, request
+from flask_resources import (
+    HTTPJSONException,
+    create_error_handler,
+    request_parser,
+    resource_requestctx,
+    response_handler,
+    route,
+)
+from invenio_base.utils import obj_or_import_string
+from invenio_files_rest.helpers import send_stream
 from invenio_records_resources.resources import FileResource as BaseFileResource
 from invenio_records_resources.resources import (
     FileResourceConfig as BaseFileResourceConfig,
@@ -26,6 +42,26 @@ from invenio_records_resources.resources import RecordResource as BaseRecordReso
 from invenio_records_resources.resources import (
     RecordResourceConfig as BaseRecordResourceConfig,
 )
+from invenio_records_resources.resources.files.resource import request_view_args
+from invenio_records_resources.services.errors import FileKeyNotFoundError
+from invenio_stats.proxies import current_stats
+
+from .components import ThumbnailAndFulltextComponent
+from .pages import PageNotFoundError
+
+request_page_view_args = request_parser(
+    {
+        "pid_value": ma.fields.Str(required=True),
+        "key": ma.fields.Str(),
+        "page": ma.fields.Int(required=True),
+    },
+    location="view_args",
+)
+
+request_page_args = request_parser(
+    {"width": ma.fields.Int(validate=ma.validate.Range(min=1))},
+    location="args",
+)
 
 
 class RecordResourceConfig(BaseRecordResourceConfig):
@@ -44,7 +80,332 @@ class FileResourceConfig(BaseFileResourceConfig):
 
     url_prefix = "/records/<pid_value>"
     blueprint_name = "records_files"
+    routes = {
+        **BaseFileResourceConfig.routes,
+        "list-upload": "/files-upload",
+        "page-image": "/files/<path:key>/pages/<int:page>.jpg",
+        "page-text": "/files/<path:key>/pages/<int:page>.txt",
+    }
+
+    error_handlers = {
+        PageNotFoundError: create_error_handler(
+            lambda e: HTTPJSONException(code=404, description=str(e))
+        ),
+    }
+
+    content_accept_ranges = True
+    """Serve the byte ranges requested by the clients.
+
+    Large PDF files can then be displayed progressively by pdf.js.
+    """
+
+    content_max_age = 0
+    """Cache lifetime in seconds of the uploaded files.
+
+    The cached contents are revalidated using their checksum as ETag.
+    """
+
+    derived_content_max_age = 24 * 60 * 60
+    """Cache lifetime in seconds of the thumbnails and the fulltexts.
+
+    The derived files are regenerated with the same key, thus they are not
+    cached forever.
+    """
+
+    content_public = False
+    """Allow the shared caches, such as a CDN, to store the file contents.
+
+    Only for public files, the contents are cached by the browsers otherwise.
+    """
 
 
 class FileResource(BaseFileResource):
     """Record file resource."""
+
+    def create_url_rules(self):
+        """Routing for the views."""
+        url_rules = super().create_url_rules()
+        if self.config.allow_upload:
+            url_rules.append(
+                route("POST", self.config.routes["list-upload"], self.create_upload)
+            )
+        url_rules += [
+            route("GET", self.config.routes["page-image"], self.read_page_image),
+            route("GET", self.config.routes["page-text"], self.read_page_text),
+        ]
+        return url_rules
+
+    @request_view_args
+    @response_handler(many=True)
+    def create_upload(self):
+        """Upload and commit several files sent as multipart form data."""
+        files = [
+            {"key": file.filename, "stream": file.stream}
+            for file in request.files.getlist("file")
+        ]
+        items = self.service.bulk_create_files(
+            g.identity,
+            resource_requestctx.view_args["pid_value"],
+            files,
+        )
+        return items.to_dict(), 201
+
+    def get_thumbnail_content(self, id_, key):
+        """Get the thumbnail content in the best format accepted by the client.
+
+        :param id_: str - the record identifier.
+        :param key: str - the jpg thumbnail key.
+        :returns: the file content item or None if no other format matches.
+        """
+        accept = request.accept_mimetypes
+        # only the formats listed by the client, some clients accepting
+        # image/* do not support the recent formats
+        qualities = {mimetype: quality for mimetype, quality in accept}
+        jpeg_quality = accept.quality("image/jpeg")
+        for image_format in sorted(
+            current_app.config["RERO_FILES_THUMBNAIL_FORMATS"],
+            key=lambda image_format: qualities.get(f"image/{image_format}", 0),
+            reverse=True,
+        ):
+            quality = qualities.get(f"image/{image_format}", 0)
+            # the formats are sorted by client preference
+            if not quality or quality < jpeg_quality:
+                return None
+            try:
+                item = self.service.get_file_content(
+                    g.identity, id_, f"{key[:-len('jpg')]}{image_format}"
+                )
+            except FileKeyNotFoundError:
+                continue
+            # not an uploaded file with the same name
+            if (item._file.get("metadata") or {}).get("type") == "thumbnail":
+                return item
+
+    @staticmethod
+    def get_proxy_path(file_instance, mode):
+        """Get the path of a file for the front proxy.
+
+        :param file_instance: FileInstance - the file to send.
+        :param mode: str - x-accel-redirect or x-sendfile.
+        :returns: the proxy path or None if the file cannot be offloaded.
+        """
+        parsed = urlparse(file_instance.uri)
+        if parsed.scheme not in ["", "file"]:
+            return None
+        locations = current_app.config["RERO_FILES_CONTENT_OFFLOAD_LOCATIONS"]
+        for directory, location in locations.items():
+            directory = directory.rstrip("/")
+            if parsed.path.startswith(f"{directory}/"):
+                return location.rstrip("/") + parsed.path[len(directory) :]
+        if mode == "x-sendfile":
+            return parsed.path
+
+    def offload_content(self, item, trusted=False, file_instance=None):
+        """Hand the transfer of a file content over to the front proxy.
+
+        :param item: FileItem - the file content item, already checked by the
+            permissions.
+        :param trusted: bool - send the file mime type without sanitization.
+        :param file_instance: FileInstance - the file to send instead of the
+            item file, such as a linearized copy.
+        :returns: a response without content or a redirection, None if the
+            content has to be sent by the application.
+        """
+        config = current_app.config
+        mode = config["RERO_FILES_CONTENT_OFFLOAD"]
+        obj = item._file.object_version
+        file_instance = file_instance or obj.file
+        if mode == "redirect":
+            factory = obj_or_import_string(
+                config["RERO_FILES_CONTENT_PRESIGNED_URL_FACTORY"]
+            )
+            url = factory and factory(
+                file_instance, config["RERO_FILES_CONTENT_PRESIGNED_URL_EXPIRES"]
+            )
+            return redirect(url) if url else None
+        if mode not in ["x-accel-redirect", "x-sendfile"]:
+            return None
+        if not (path := self.get_proxy_path(file_instance, mode)):
+            return None
+        # same headers as the streamed content, the proxy sends the body
+        response = send_stream(
+            BytesIO(),
+            obj.basename,
+            file_instance.size,
+            timegm(file_instance.updated.timetuple()),
+            mimetype=obj.mimetype,
+            etag=file_instance.checksum,
+            trusted=trusted,
+        )
+        del response.headers["Content-Length"]
+        if response.status_code != 304:
+            if mode == "x-accel-redirect":
+                response.headers["X-Accel-Redirect"] = quote(path)
+            else:
+                response.headers["X-Sendfile"] = path
+        return response
+
+    def set_cache_control(self, response, max_age):
+        """Add the cache headers of a file content.
+
+        :param response: Response - the file content response.
+        :param max_age: int - the cache lifetime in seconds.
+        """
+        response.cache_control.max_age = max_age
+        if self.config.content_public:
+            response.cache_control.public = True
+        else:
+            response.cache_control.private = True
+
+    def make_content_conditional(self, response, item, ranges=True):
+        """Add the cache headers and handle the conditional and range requests.
+
+        :param response: Response - the file content response.
+        :param item: FileItem - the file content item.
+        :param ranges: bool - handle the range requests, not needed when the
+            content is sent by the front proxy.
+        :returns: the response, with a 304 or 206 status code if needed.
+        """
+        file_type = (item._file.get("metadata") or {}).get("type")
+        if file_type in ThumbnailAndFulltextComponent.derived_types:
+            self.set_cache_control(response, self.config.derived_content_max_age)
+        else:
+            self.set_cache_control(response, self.config.content_max_age)
+        if not ranges:
+            return response
+        if self.config.content_accept_ranges:
+            response.accept_ranges = "bytes"
+        # the file sending already handles the ETag and last modification
+        # date validation, but not the ranges
+        if response.status_code != 304:
+            response.make_conditional(
+                request,
+                accept_ranges=self.config.content_accept_ranges,
+                complete_length=response.content_length,
+            )
+        return response
+
+    @staticmethod
+    def get_linearized_file(item):
+        """Get the linearized copy of a pdf file.
+
+        :param item: FileItem - the file content item.
+        :returns: the FileInstance of the copy or None if there is no copy.
+        """
+        file_record = item._file
+        if (
+            not current_app.config["RERO_FILES_PDF_LINEARIZE"]
+            or (file_record.get("metadata") or {}).get("type")
+            or file_record.file.mimetype != "application/pdf"
+        ):
+            return None
+        key = ThumbnailAndFulltextComponent.change_filename_extension(
+            file_record.key, "linear.pdf"
+        )
+        # the record permissions have been checked for the original file
+        linearized = item._record.files.get(key)
+        if (
+            linearized
+            and (linearized.metadata or {}).get("linearized_for") == file_record.key
+        ):
+            return linearized.object_version.file
+
+    @request_view_args
+    def read_content(self):
+        """Read file content.
+
+        The thumbnails are sent in an other format, such as webp, when the
+        client accepts it. The pdf files are sent linearized if they have a
+        linearized copy. The conditional and range requests are supported.
+        """
+        id_ = resource_requestctx.view_args["pid_value"]
+        key = resource_requestctx.view_args["key"]
+        item = self.service.get_file_content(g.identity, id_, key)
+        # only the derived thumbnails, not the uploaded jpg files
+        negotiate = (
+            current_app.config["RERO_FILES_THUMBNAIL_FORMATS"]
+            and key.endswith(".jpg")
+            and (item._file.get("metadata") or {}).get("type") == "thumbnail"
+        )
+        # generated images with a mime type such as image/webp, not allowed by
+        # the default sanitization
+        trusted = False
+        if negotiate and (thumbnail := self.get_thumbnail_content(id_, key)):
+            item = thumbnail
+            trusted = True
+
+        obj = item._file.object_version
+        file_instance = self.get_linearized_file(item) or obj.file
+        response = self.offload_content(item, trusted, file_instance)
+        offloaded = response is not None
+        if not offloaded:
+            response = file_instance.send_file(
+                obj.basename, mimetype=obj.mimetype, trusted=trusted
+            )
+        if negotiate:
+            response.vary.add("Accept")
+        # not redirected to the object storage
+        if not response.location:
+            response = self.make_content_conditional(
+                response, item, ranges=not offloaded
+            )
+
+        # emit file download stats event, once for the partial contents
+        emitter = current_stats.get_event_emitter("file-download")
+        content_range = response.content_range
+        if (
+            obj is not None
+            and emitter is not None
+            and response.status_code != 304
+            and (content_range is None or content_range.start == 0)
+        ):
+            emitter(current_app, record=item._record, obj=obj, via_api=True)
+
+        return response, response.status_code
+
+    @request_page_view_args
+    @request_page_args
+    def read_page_image(self):
+        """Read a page of a file rendered as a JPEG image.
+
+        The page is rendered on the first request, the ``width`` argument is
+        rounded up to the next configured width.
+        """
+        id_ = resource_requestctx.view_args["pid_value"]
+        key = resource_requestctx.view_args["key"]
+        page = resource_requestctx.view_args["page"]
+        image = self.service.get_page_image(
+            g.identity, id_, key, page, resource_requestctx.args.get("width")
+        )
+        filename = ThumbnailAndFulltextComponent.change_filename_extension(
+            key, f"{page}.jpg"
+        )
+        if isinstance(image, bytes):
+            # the derivative cache is disabled
+            response = send_stream(
+                BytesIO(image),
+                filename,
+                len(image),
+                time.time(),
+                mimetype="image/jpeg",
+                trusted=True,
+            )
+        else:
+            response = image.send_file(filename, mimetype="image/jpeg", trusted=True)
+        self.set_cache_control(response, self.config.derived_content_max_age)
+        return response, response.status_code
+
+    @request_page_view_args
+    def read_page_text(self):
+        """Read the text of a page of a file."""
+        text = self.service.get_page_text(
+            g.identity,
+            resource_requestctx.view_args["pid_value"],
+            resource_requestctx.view_args["key"],
+            resource_requestctx.view_args["page"],
+        )
+        response = Response(text, mimetype="text/plain")
+        response.add_etag()
+        self.set_cache_control(response, self.config.derived_content_max_age)
+        response.make_conditional(request)
+        return response, response.status_code
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run the derivations in a subprocess with limited resources."""
+
+import multiprocessing
+import os
+import resource
+import signal
+import time
+
+
+class DerivationError(Exception):
+    """A derivation has been stopped or has failed in its subprocess."""
+
+
+def process_rss(pid):
+    """Resident memory of a process.
+
+    :param pid: int - the process id.
+    :returns: the resident memory in bytes, None if it is not available.
+    """
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def run_limited(sender, func, args, cpu_limit):
+    """Run a function and send its result, in the subprocess.
+
+    :param sender: Connection - the pipe to send the result to.
+    :param func: callable - the function to run.
+    :param args: list - the function arguments.
+    :param cpu_limit: int - the maximal CPU time in seconds.
+    """
+    if cpu_limit:
+        # SIGXCPU at the soft limit, SIGKILL one second later
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit + 1))
+    try:
+        result = (True, func(*args))
+    except MemoryError:
+        result = (False, "memory limit exceeded")
+    except Exception as error:
+        result = (False, f"{error.__class__.__name__}: {error}")
+    sender.send(result)
+    sender.close()
+
+
+def exit_reason(exitcode):
+    """Human readable reason of an unexpected subprocess exit.
+
+    :param exitcode: int - the process exit code, negative for a signal.
+    :returns: the reason.
+    """
+    if exitcode is not None and exitcode < 0:
+        if -exitcode == signal.SIGXCPU:
+            return "CPU time limit exceeded"
+        return f"killed by signal {signal.Signals(-exitcode).name}"
+    return f"exited with code {exitcode}"
+
+
+def run_in_sandbox(
+    func, *args, timeout=None, cpu_limit=None, memory_limit=None, interval=0.1
+):
+    """Run a function in a forked subprocess with limited resources.
+
+    The subprocess is killed when it runs longer than the wall clock timeout
+    or when its resident memory exceeds the memory limit. The CPU time is
+    limited by the system. The function and its arguments are inherited by
+    the forked process, only the result has to be picklable.
+
+    :param func: callable - the function to run.
+    :param args: list - the function arguments.
+    :param timeout: float - the maximal duration in seconds.
+    :param cpu_limit: int - the maximal CPU time in seconds.
+    :param memory_limit: int - the maximal resident memory in bytes.
+    :param interval: float - the delay in seconds between two checks.
+    :returns: the result of the function.
+    :raises DerivationError: if the function fails or is stopped.
+    """
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=run_limited, args=(sender, func, args, cpu_limit))
+    start = time.monotonic()
+    process.start()
+    sender.close()
+    try:
+        while not receiver.poll(interval):
+            if timeout and time.monotonic() - start > timeout:
+                raise DerivationError(f"timeout after {timeout}s")
+            if memory_limit and (process_rss(process.pid) or 0) > memory_limit:
+                raise DerivationError(f"memory limit of {memory_limit} bytes exceeded")
+        try:
+            success, result = receiver.recv()
+        except EOFError:
+            process.join()
+            raise DerivationError(exit_reason(process.exitcode))
+        if not success:
+            raise DerivationError(result)
+        return result
+    finally:
+        if process.is_alive():
+            process.kill()
+        process.join()
+        receiver.close()
@@ -17,6 +17,14 @@
 
 """Files support for the RERO invenio instances."""
 
+import bisect
+import contextlib
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+from flask import current_app
+from invenio_files_rest.models import FileInstance
+from invenio_files_rest.tasks import remove_file_data
 from invenio_records_resources.services import FileService as BaseFileService
 from invenio_records_resources.services import (
     FileServiceConfig as BaseFileServiceConfig,
@@ -25,11 +33,16 @@ from invenio_records_resources.services import RecordService as BaseRecordServic
 from invenio_records_resources.services import (
     RecordServiceConfig as BaseRecordServiceConfig,
 )
+from invenio_records_resources.services.errors import FileKeyNotFoundError
 from invenio_records_resources.services.files.links import FileLink
 from invenio_records_resources.services.records.components import FilesComponent
+from invenio_records_resources.services.uow import TaskOp, unit_of_work
 
+from ..pdf import PDFGenerator
+from ..proxies import current_rero_invenio_files
 from .api import RecordWithFile
-from .components import ThumbnailAndFulltextComponent
+from .components import DerivationContext, ThumbnailAndFulltextComponent
+from .pages import PagedText, PageNotFoundError
 from .permissions import PermissionPolicy
 from .schema import RecordSchema
 
@@ -39,7 +52,10 @@ class PreviewFileLink(FileLink):
 
     def should_render(self, obj, ctx):
         """Determine if the link should be rendered."""
-        if obj.get("metadata", {}).get("type") in ["thumbnail", "fulltext"]:
+        if (
+            obj.get("metadata", {}).get("type")
+            in ThumbnailAndFulltextComponent.derived_types
+        ):
             return False
         # here we cannot use invenio previewer as it is available only on ui
         # pdf is supported
@@ -51,18 +67,58 @@ class PreviewFileLink(FileLink):
 class ThumbFileLink(PreviewFileLink):
     """Add the thumbnail file name variable to generate the thumbnail links."""
 
-    @staticmethod
-    def vars(file_record, vars):
+    def __init__(self, uritemplate, size=None, **kwargs):
+        """Constructor.
+
+        :param uritemplate: str - the URI template.
+        :param size: int - the thumbnail size, None for the default size.
+        """
+        super().__init__(uritemplate, **kwargs)
+        self.size = size
+
+    def should_render(self, obj, ctx):
+        """Determine if the link should be rendered."""
+        if (
+            self.size is not None
+            and self.size not in ThumbnailAndFulltextComponent.get_thumbnail_sizes()
+        ):
+            return False
+        return super().should_render(obj, ctx)
+
+    def vars(self, file_record, vars):
         """Variables for the URI template."""
         vars.update(
             {
                 "thumb": ThumbnailAndFulltextComponent.change_filename_extension(
-                    file_record.key, "jpg"
+                    file_record.key,
+                    ThumbnailAndFulltextComponent.get_thumbnail_extension(self.size),
                 )
             }
         )
 
 
+class ThumbnailsFileLink(PreviewFileLink):
+    """Links of all the thumbnail sizes."""
+
+    def should_render(self, obj, ctx):
+        """Determine if the link should be rendered."""
+        if not current_app.config["RERO_FILES_THUMBNAIL_RENDITIONS"]:
+            return False
+        return super().should_render(obj, ctx)
+
+    def expand(self, obj, context):
+        """Expand the URI Template for each thumbnail size.
+
+        :returns: a dict of the links by size.
+        """
+        return {
+            str(size): ThumbFileLink(self._uritemplate.uri, size=size).expand(
+                obj, context
+            )
+            for size in ThumbnailAndFulltextComponent.get_thumbnail_sizes()
+        }
+
+
 class RecordServiceConfig(BaseRecordServiceConfig):
     """Record service configuration.
 
@@ -92,6 +148,7 @@ class FileServiceConfig(BaseFileServiceConfig):
         "commit": FileLink("{+api}/records/{id}/files/{+key}/commit"),
         "preview": PreviewFileLink("{+ui}/records/preview/{id}/{+key}"),
         "thumbnail": ThumbFileLink("{+api}/records/{id}/files/{+thumb}/content"),
+        "thumbnails": ThumbnailsFileLink("{+api}/records/{id}/files/{+thumb}/content"),
     }
     service_id = "records-files"
     # component processors
@@ -101,6 +158,265 @@ class FileServiceConfig(BaseFileServiceConfig):
     ]
 
 
+class RecordFileService(BaseFileService):
+    """Record files service."""
+
+    @unit_of_work()
+    def bulk_create_files(self, identity, id_, files, uow=None):
+        """Initialize, upload and commit several files in one unit of work.
+
+        The permissions are checked and the record is fetched only once.
+
+        :param identity: flask principal Identity
+        :param id_: str - record id.
+        :param files: list of dict - the file metadata with the file ``key``,
+            the file ``stream`` and an optional ``content_length``.
+        """
+        record = self._get_record(id_, identity, "create_files")
+        self._create_files(identity, id_, record, files, uow=uow)
+        return self.file_result_list(
+            self,
+            identity,
+            results=record.files.values(),
+            record=record,
+            links_tpl=self.file_links_list_tpl(id_),
+            links_item_tpl=self.file_links_item_tpl(id_),
+        )
+
+    def _create_files(self, identity, id_, record, files, uow=None):
+        """Initialize, upload and commit several files of a fetched record.
+
+        :param identity: flask principal Identity
+        :param id_: str - record id.
+        :param record: Record - the record, checked for the files creation.
+        :param files: list of dict - the file metadata with the file ``key``,
+            the file ``stream`` and an optional ``content_length``.
+        """
+        for action in ["set_content_files", "commit_files"]:
+            self.require_permission(identity, action, record=record)
+
+        data = [
+            {k: v for k, v in file.items() if k not in ["stream", "content_length"]}
+            for file in files
+        ]
+        self.run_components("init_files", identity, id_, record, data, uow=uow)
+        for file in files:
+            self.run_components(
+                "set_file_content",
+                identity,
+                id_,
+                file["key"],
+                file["stream"],
+                file.get("content_length"),
+                record,
+                uow=uow,
+            )
+        for file in files:
+            self.run_components(
+                "commit_file", identity, id_, file["key"], record, uow=uow
+            )
+
+    @unit_of_work()
+    def create_pdf_file(
+        self,
+        identity,
+        id_,
+        key,
+        data,
+        metadata=None,
+        linearize=False,
+        generator_cls=PDFGenerator,
+        uow=None,
+    ):
+        """Generate a PDF file and store it in a record.
+
+        The PDF document is generated with the ``RERO_FILES_PDF_OPTIONS``
+        and written to a spooled temporary file, which is kept in memory up
+        to ``RERO_FILES_PDF_SPOOL_SIZE``, and then stored.
+
+        :param identity: flask principal Identity
+        :param id_: str - record id.
+        :param key: str - the file key of the generated file.
+        :param data: dict - the given data of the PDF generator.
+        :param metadata: dict - the file metadata.
+        :param linearize: bool - linearize the PDF for the fast web view.
+        :param generator_cls: class - the PDF generator class.
+        """
+        record = self._get_record(id_, identity, "create_files")
+        pdf = generator_cls(data, **current_app.config["RERO_FILES_PDF_OPTIONS"])
+        pdf.render()
+        with SpooledTemporaryFile(
+            max_size=current_app.config["RERO_FILES_PDF_SPOOL_SIZE"]
+        ) as stream:
+            content_length = pdf.output_to_stream(stream, linearize=linearize)
+            stream.seek(0)
+            # the metadata keys are stored as the file metadata
+            file = dict(
+                metadata or {}, key=key, stream=stream, content_length=content_length
+            )
+            self._create_files(identity, id_, record, [file], uow=uow)
+
+        return self.file_result_item(
+            self,
+            identity,
+            record.files[key],
+            record,
+            links_tpl=self.file_links_item_tpl(id_),
+        )
+
+    @unit_of_work()
+    def create_derivatives(self, identity, id_, file_key, uow=None):
+        """Create the derived files (thumbnail, fulltext) of a given file.
+
+        :raises FileKeyNotFoundError: If the record has no file for the ``file_key``
+        """
+        record = self._get_record(id_, identity, "commit_files", file_key=file_key)
+
+        self.run_components(
+            "create_derivatives", identity, id_, file_key, record, uow=uow
+        )
+
+        return self.file_result_item(
+            self,
+            identity,
+            record.files[file_key],
+            record,
+            links_tpl=self.file_links_item_tpl(id_),
+        )
+
+    @contextlib.contextmanager
+    def open_paged_text(self, identity, id_, file_key):
+        """Open the fulltext of a given file with its page index.
+
+        :param identity: flask principal Identity
+        :param id_: str - record id.
+        :param file_key: str - key of the original file.
+        :returns: a context manager of the ``PagedText``.
+        :raises FileKeyNotFoundError: If the file has no fulltext or no page
+            index.
+        """
+        record = self._get_record(id_, identity, "get_content_files", file_key=file_key)
+        keys = [
+            ThumbnailAndFulltextComponent.change_filename_extension(file_key, extension)
+            for extension in ["txt", "txt.idx"]
+        ]
+        for key in keys:
+            if key not in record.files:
+                raise FileKeyNotFoundError(id_, key)
+        text_key, index_key = keys
+        with record.files[text_key].open_stream("rb") as text_stream:
+            with record.files[index_key].open_stream("rb") as index_stream:
+                yield PagedText(text_stream, index_stream)
+
+    def get_page_text(self, identity, id_, file_key, page):
+        """Get the text of a page of a given file.
+
+        :param identity: flask principal Identity
+        :param id_: str - record id.
+        :param file_key: str - key of the original file.
+        :param page: int - the page number, from 1.
+        :returns: the text of the page.
+        :raises PageNotFoundError: if the page does not exist.
+        """
+        with self.open_paged_text(identity, id_, file_key) as paged_text:
+            return paged_text.get_page_text(page)
+
+    def get_text_snippet(self, identity, id_, file_key, offset, size=200):
+        """Get the text around an offset of the fulltext of a given file.
+
+        :param identity: flask principal Identity
+        :param id_: str - record id.
+        :param file_key: str - key of the original file.
+        :param offset: int - the byte offset of a hit in the fulltext.
+        :param size: int - the number of bytes before and after the offset.
+        :returns: a dict of the page number, the byte range and the text.
+        :raises PageNotFoundError: if the offset is outside the fulltext.
+        """
+        with self.open_paged_text(identity, id_, file_key) as paged_text:
+            return paged_text.get_snippet(offset, size)
+
+    @staticmethod
+    def get_page_width(width=None):
+        """Get the rendered width of a page image.
+
+        :param width: int - the requested width in pixels.
+        :returns: the next configured width, the largest one if the requested
+            width is larger, the first one if no width is requested.
+        """
+        widths = current_app.config["RERO_FILES_PAGE_IMAGE_WIDTHS"]
+        if not width:
+            return widths[0]
+        allowed = sorted(widths)
+        return allowed[min(bisect.bisect_left(allowed, width), len(allowed) - 1)]
+
+    @unit_of_work()
+    def get_page_image(self, identity, id_, file_key, page, width=None, uow=None):
+        """Get a page of a given file rendered as a JPEG image.
+
+        The page is rendered on the first request, with the derivation
+        limits, and kept in the page image cache. The evicted page images not
+        used by a record are removed after the commit. The files on a remote
+        storage are downloaded to render a page, for each request if the
+        cache is disabled.
+
+        :param identity: flask principal Identity
+        :param id_: str - record id.
+        :param file_key: str - key of the original file.
+        :param page: int - the page number, from 1.
+        :param width: int - the requested width in pixels.
+        :returns: the file instance of the image, or the image binary data if
+            the page image cache is disabled.
+        :raises FileKeyNotFoundError: If the record has no file for the
+            ``file_key``.
+        :raises PageNotFoundError: if the page does not exist or the file
+            pages cannot be rendered.
+        """
+        record = self._get_record(id_, identity, "get_content_files", file_key=file_key)
+        file_record = record.files[file_key]
+        rfile = file_record.file
+        engine = ThumbnailAndFulltextComponent.get_engine(rfile.mimetype)
+        if not engine or not engine.page_images:
+            raise PageNotFoundError(f"{file_key} pages cannot be rendered")
+        params = dict(
+            page=page,
+            width=self.get_page_width(width),
+            quality=current_app.config["RERO_FILES_PAGE_IMAGE_QUALITY"],
+        )
+        cache = current_rero_invenio_files.page_image_cache
+        if file_instance := cache.get(rfile.checksum, cache.derivation, **params):
+            return file_instance
+        with ThumbnailAndFulltextComponent.measure(
+            "page", rfile.mimetype, rfile.size
+        ) as measurement:
+            with DerivationContext(file_record) as context:
+                # checked before the sandbox, which hides the exception type
+                if not 1 <= page <= context.page_count:
+                    raise PageNotFoundError(f"page {page} out of range")
+                measurement.page_count = context.page_count
+                blob = ThumbnailAndFulltextComponent.run_engine_step(
+                    context,
+                    engine.render_page,
+                    rfile.mimetype,
+                    params["page"],
+                    params["width"],
+                    params["quality"],
+                )
+            measurement.output_bytes = len(blob)
+        if not cache.max_size:
+            return blob
+        file_instance = FileInstance.create()
+        file_instance.set_contents(
+            BytesIO(blob),
+            default_location=record.bucket.location.uri,
+            default_storage_class=record.bucket.default_storage_class,
+        )
+        # the page images can be removed, unlike the record files
+        file_instance.writable = True
+        evicted = cache.set(rfile.checksum, file_instance, cache.derivation, **params)
+        for file_id in cache.get_unused_files([file_id for _, file_id in evicted]):
+            uow.register(TaskOp(remove_file_data, str(file_id)))
+        return file_instance
+
+
 # service classes
-RecordFileService = BaseFileService
 RecordService = BaseRecordService
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Stream helpers for the files derivation."""
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+from urllib.parse import urlparse
+
+
+class IterStream(io.RawIOBase):
+    """Read only file like object over an iterable of bytes chunks.
+
+    Only the current chunk is kept in memory, which allows to store a
+    generated content with a bounded memory footprint.
+    """
+
+    def __init__(self, iterable):
+        """Constructor.
+
+        :param iterable: iterable - the bytes chunks.
+        """
+        self._iterator = iter(iterable)
+        self._buffer = memoryview(b"")
+
+    def readable(self):
+        """The stream is readable."""
+        return True
+
+    def peek(self):
+        """Return the next non empty chunk without consuming it.
+
+        :returns: the next chunk or an empty value at the end of the stream.
+        """
+        while not self._buffer:
+            try:
+                self._buffer = memoryview(next(self._iterator))
+            except StopIteration:
+                break
+        return self._buffer
+
+    def readinto(self, b):
+        """Read bytes into a pre-allocated bytes-like object.
+
+        :param b: bytearray - the buffer to fill.
+        :returns: the number of bytes read, 0 at the end of the stream.
+        """
+        chunk = self.peek()
+        size = min(len(b), len(chunk))
+        b[:size] = chunk[:size]
+        self._buffer = chunk[size:]
+        return size
+
+    def close(self):
+        """Close the stream and the underlying iterator."""
+        if hasattr(self._iterator, "close"):
+            self._iterator.close()
+        super().close()
+
+
+@contextlib.contextmanager
+def local_path(file_record, chunk_size=1024 * 1024):
+    """Get a local path to read a record file.
+
+    The files stored on a local file system are used in place. The other
+    files, on an object storage for example, are read once through the
+    storage interface into a temporary file removed at the end.
+
+    :param file_record: FileRecord - the record file.
+    :param chunk_size: int - the size of the chunks read from the storage.
+    :returns: a context manager of the local file path.
+    """
+    parsed = urlparse(file_record.file.uri)
+    if parsed.scheme in ["", "file"] and os.path.isfile(parsed.path):
+        yield parsed.path
+        return
+    _, extension = os.path.splitext(file_record.key)
+    with file_record.open_stream("rb") as stream, tempfile.NamedTemporaryFile(
+        suffix=extension
+    ) as local_file:
+        shutil.copyfileobj(stream, local_file, chunk_size)
+        local_file.flush()
+        yield local_file.name
+
+
+class LocalFile:
+    """Local access to a record file, made only when it is needed.
+
+    The derived files taken from the derivative cache do not need the
+    original file, which is then never read from the storage.
+    """
+
+    def __init__(self, file_record):
+        """Constructor.
+
+        :param file_record: FileRecord - the record file.
+        """
+        self.file_record = file_record
+        self._stack = contextlib.ExitStack()
+        self._path = None
+
+    @property
+    def path(self):
+        """Local path of the file."""
+        if self._path is None:
+            self._path = self._stack.enter_context(local_path(self.file_record))
+        return self._path
+
+    def __enter__(self):
+        """Enter the runtime context."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Remove the temporary local copy, if any."""
+        self._stack.close()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Celery tasks for the files derivation."""
+
+from celery import shared_task
+from flask import current_app
+from invenio_access.permissions import system_identity
+from invenio_db import db
+from invenio_records_resources.proxies import current_service_registry
+from invenio_records_resources.services.uow import UnitOfWork
+
+
+def set_failed_status(service, record_id, file_key, error):
+    """Mark the derivation of a record file as failed.
+
+    :param service: FileService - the file service.
+    :param record_id: str - the record identifier.
+    :param file_key: str - file key in the file record.
+    :param error: Exception - the unexpected error.
+    """
+    # the components module sends this task
+    from .components import ThumbnailAndFulltextComponent
+
+    with UnitOfWork() as uow:
+        record = service.record_cls.pid.resolve(record_id, registered_only=False)
+        if file_key not in record.files:
+            return
+        component = ThumbnailAndFulltextComponent(service)
+        component.uow = uow
+        component.set_derivation_status(
+            record, file_key, "failed", f"{error.__class__.__name__}: {error}"
+        )
+        uow.commit()
+
+
+@shared_task(ignore_result=True)
+def create_derivatives(service_id, record_id, file_key):
+    """Create the thumbnail and the fulltext of a record file.
+
+    An unexpected error sets the derivation status to failed, the file is
+    not left pending.
+
+    :param service_id: str - the file service identifier.
+    :param record_id: str - the record identifier.
+    :param file_key: str - file key in the file record.
+    """
+    service = current_service_registry.get(service_id)
+    try:
+        service.create_derivatives(system_identity, record_id, file_key)
+    except Exception as error:
+        current_app.logger.exception(
+            f"Failed to create the derived files for {record_id}:{file_key}."
+        )
+        db.session.rollback()
+        set_failed_status(service, record_id, file_key, error)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Benchmarks configuration.
+
+The benchmarks are skipped by the default test run, as they build large
+files, use ``pytest tests/benchmarks --benchmark-enable`` to run them and
+collect the timings.
+
+Add ``--benchmark-autosave`` to store the results as JSON in
+``.benchmarks``, and ``--benchmark-compare --benchmark-compare-fail=mean:10%``
+to compare a run with the last saved one, for example the previous release.
+"""
+
+import fitz
+import pytest
+
+from rero_invenio_files.pdf import PDFGenerator
+
+PDF_PAGES = [1, 100, 2000]
+"""Number of pages of the benchmarked pdf files."""
+
+IMAGE_SIZES = [(640, 480), (3000, 2000), (8000, 6000)]
+"""Width and height of the benchmarked images."""
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip the benchmarks unless they are enabled.
+
+    :param config: Config - the pytest configuration.
+    :param items: list - the collected test items.
+    """
+    if config.getoption("benchmark_enable"):
+        return
+    skip = pytest.mark.skip(reason="use --benchmark-enable to run the benchmarks")
+    for item in items:
+        if "benchmark" in getattr(item, "fixturenames", []):
+            item.add_marker(skip)
+
+
+def generate_pdf(data, pages):
+    """Generate a PDF document with a given number of pages.
+
+    The first page is rendered using the PDFGenerator and then duplicated.
+
+    :param data: dict - the data of the PDF page.
+    :param pages: int - the number of pages.
+    :returns: the PDF binary content.
+    """
+    pdf = PDFGenerator(data)
+    pdf.render()
+    with fitz.open(stream=pdf.output(), filetype="pdf") as page_doc:
+        with fitz.open() as pdf_doc:
+            while pdf_doc.page_count < pages:
+                pdf_doc.insert_pdf(page_doc)
+            return pdf_doc.tobytes()
+
+
+@pytest.fixture(scope="module")
+def large_pdf_path(tmp_path_factory, simple_data):
+    """Path of a 500 pages PDF file."""
+    file_path = tmp_path_factory.mktemp("benchmarks") / "large.pdf"
+    file_path.write_bytes(generate_pdf(simple_data, 500))
+    return str(file_path)
+
+
+def generate_image(data, width, height):
+    """Generate a JPEG image of a given size.
+
+    The image is the first page of a PDF document scaled to the given size.
+
+    :param data: dict - the data of the PDF page.
+    :param width: int - the width of the image.
+    :param height: int - the height of the image.
+    :returns: the JPEG binary content.
+    """
+    pdf = PDFGenerator(data)
+    pdf.render()
+    with fitz.open(stream=pdf.output(), filetype="pdf") as pdf_doc:
+        pixmap = pdf_doc[0].get_pixmap(dpi=150)
+    return fitz.Pixmap(pixmap, width, height, None).tobytes("jpg")
+
+
+@pytest.fixture(
+    scope="module", params=PDF_PAGES, ids=[f"{pages}-pages" for pages in PDF_PAGES]
+)
+def pdf_path(request, tmp_path_factory, simple_data):
+    """Path of PDF files of several number of pages."""
+    file_path = tmp_path_factory.mktemp("benchmarks") / f"{request.param}.pdf"
+    file_path.write_bytes(generate_pdf(simple_data, request.param))
+    return str(file_path)
+
+
+@pytest.fixture(
+    scope="module",
+    params=IMAGE_SIZES,
+    ids=[f"{width}x{height}" for width, height in IMAGE_SIZES],
+)
+def image_path(request, tmp_path_factory, simple_data):
+    """Path of JPEG images of several resolutions."""
+    width, height = request.param
+    file_path = tmp_path_factory.mktemp("benchmarks") / f"{width}x{height}.jpg"
+    file_path.write_bytes(generate_image(simple_data, width, height))
+    return str(file_path)
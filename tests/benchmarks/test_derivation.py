@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Pdf derivation benchmarks."""
+
+import fitz
+import pytest
+
+from rero_invenio_files.records.engines import DocumentEngine
+
+
+def derive(file_path):
+    """Create the thumbnail and the fulltext of a pdf file."""
+    with fitz.open(file_path) as document:
+        DocumentEngine.create_thumbnails_from_document(
+            document, [dict(size=200, quality=95)]
+        )
+    return b"".join(DocumentEngine.iter_fulltext_from_file(file_path))
+
+
+def derive_shared(file_path):
+    """Create the derived files of a pdf file parsed only once."""
+    with fitz.open(file_path) as document:
+        DocumentEngine.create_thumbnails_from_document(
+            document, [dict(size=200, quality=95)]
+        )
+        return b"".join(
+            DocumentEngine.iter_fulltext_from_file(file_path, document=document)
+        )
+
+
+@pytest.mark.parametrize("func", [derive, derive_shared])
+def test_pdf_derivation(benchmark, large_pdf_path, func):
+    """Compare the derivation with a pdf document parsed once or per step."""
+    benchmark.group = "derivation-500-pages"
+    assert benchmark(func, large_pdf_path)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Fulltext extraction benchmarks."""
+
+import pytest
+
+from rero_invenio_files.records.engines import DocumentEngine
+
+
+@pytest.mark.parametrize("processes", [1, 2, 4])
+def test_fulltext_extraction(benchmark, large_pdf_path, processes):
+    """Compare the serial and the parallel fulltext extraction."""
+    benchmark.group = "fulltext-500-pages"
+
+    def extract():
+        return b"".join(
+            DocumentEngine.iter_fulltext_from_file(large_pdf_path, processes=processes)
+        )
+
+    assert benchmark(extract)
+
+
+def test_fulltext_pages(benchmark, pdf_path):
+    """Extract the fulltext of PDF files of several number of pages."""
+    benchmark.group = "fulltext-pages"
+
+    def extract():
+        return b"".join(DocumentEngine.iter_fulltext_from_file(pdf_path))
+
+    assert benchmark(extract)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Files ingestion benchmarks."""
+
+from io import BytesIO
+
+import pytest
+from invenio_access.permissions import system_identity
+
+from rero_invenio_files.proxies import current_rero_invenio_files
+
+NUMBER_OF_FILES = 20
+
+
+@pytest.fixture()
+def services(app, file_location, monkeypatch):
+    """Record and files services without the derivative cache."""
+    monkeypatch.setitem(app.config, "RERO_FILES_DERIVATIVE_CACHE_SIZE", 0)
+    return (
+        current_rero_invenio_files.records_service,
+        current_rero_invenio_files.records_files_service,
+    )
+
+
+def test_ingest_per_file(benchmark, services, pdf_file):
+    """Ingest the files of a record one by one."""
+    benchmark.group = f"ingest-{NUMBER_OF_FILES}-files"
+    records_service, files_service = services
+
+    def ingest():
+        recid = records_service.create(system_identity, {"metadata": {}}).id
+        for number in range(NUMBER_OF_FILES):
+            key = f"file{number}.pdf"
+            files_service.init_files(system_identity, recid, [{"key": key}])
+            files_service.set_file_content(
+                system_identity, recid, key, BytesIO(pdf_file)
+            )
+            files_service.commit_file(system_identity, recid, key)
+        return recid
+
+    recid = benchmark(ingest)
+    files = files_service.list_files(system_identity, recid)
+    assert len(list(files.entries)) == 4 * NUMBER_OF_FILES
+
+
+def test_ingest_bulk(benchmark, services, pdf_file):
+    """Ingest the files of a record in one unit of work."""
+    benchmark.group = f"ingest-{NUMBER_OF_FILES}-files"
+    records_service, files_service = services
+
+    def ingest():
+        recid = records_service.create(system_identity, {"metadata": {}}).id
+        files_service.bulk_create_files(
+            system_identity,
+            recid,
+            [
+                {"key": f"file{number}.pdf", "stream": BytesIO(pdf_file)}
+                for number in range(NUMBER_OF_FILES)
+            ],
+        )
+        return recid
+
+    recid = benchmark(ingest)
+    files = files_service.list_files(system_identity, recid)
+    assert len(list(files.entries)) == 4 * NUMBER_OF_FILES
+
+
+def test_commit_file(benchmark, services, pdf_path):
+    """Commit PDF files of several number of pages, with their derivation."""
+    benchmark.group = "commit-file"
+    records_service, files_service = services
+    with open(pdf_path, "rb") as pdf:
+        content = pdf.read()
+
+    def upload():
+        recid = records_service.create(system_identity, {"metadata": {}}).id
+        files_service.init_files(system_identity, recid, [{"key": "file.pdf"}])
+        files_service.set_file_content(
+            system_identity, recid, "file.pdf", BytesIO(content)
+        )
+        return (system_identity, recid, "file.pdf"), {}
+
+    result = benchmark.pedantic(files_service.commit_file, setup=upload, rounds=3)
+    assert result.data["key"] == "file.pdf"
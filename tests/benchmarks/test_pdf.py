@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Pdf generation benchmarks."""
+
+import pytest
+
+from rero_invenio_files.pdf import PDFGenerator, render_pdf, render_pdfs
+
+NUMBER_OF_FILES = 100
+
+SIZE_OPTIONS = {
+    "default": {},
+    "strip-fonts": dict(strip_fonts=True),
+    "compression-9": dict(compression_level=9),
+    "object-streams": dict(object_streams=True),
+    "all": dict(strip_fonts=True, compression_level=9, object_streams=True),
+}
+"""PDFGenerator size options of the benchmarked pdf files."""
+
+
+@pytest.fixture(scope="module")
+def data_list(simple_data):
+    """Data of the generated pdf files."""
+    return [
+        dict(simple_data, header=f"Document pid: {number}")
+        for number in range(NUMBER_OF_FILES)
+    ]
+
+
+@pytest.mark.parametrize("processes", [1, 4])
+def test_pdf_batch(benchmark, data_list, processes):
+    """Generate a pdf file per data."""
+    benchmark.group = f"pdf-{NUMBER_OF_FILES}-files"
+    contents = benchmark(lambda: list(render_pdfs(data_list, processes=processes)))
+    assert len(contents) == NUMBER_OF_FILES
+
+
+def test_pdf_collection(benchmark, data_list):
+    """Generate a single pdf file for all the data."""
+    benchmark.group = f"pdf-{NUMBER_OF_FILES}-files"
+    assert benchmark(lambda: PDFGenerator.render_collection(data_list).output())
+
+
+@pytest.mark.parametrize("paragraphs", [1, 50])
+@pytest.mark.parametrize("options", SIZE_OPTIONS)
+def test_pdf_size(benchmark, simple_data, paragraphs, options):
+    """Generate a pdf file with given size options.
+
+    The size of the file is reported in the extra info of the benchmark.
+    """
+    benchmark.group = f"pdf-size-{paragraphs}-paragraphs"
+    data = dict(simple_data, summary="\n".join([simple_data["summary"]] * paragraphs))
+    content = benchmark(render_pdf, data, **SIZE_OPTIONS[options])
+    benchmark.extra_info["size"] = len(content)
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Files previewer benchmarks."""
+
+
+import mock
+from invenio_access.permissions import system_identity
+
+from rero_invenio_files.proxies import current_rero_invenio_files
+
+
+def test_pdf_preview(benchmark, app, client, file_location, pdf_path):
+    """Preview PDF files of several number of pages."""
+    benchmark.group = "preview-pdf"
+    records_service = current_rero_invenio_files.records_service
+    files_service = current_rero_invenio_files.records_files_service
+    recid = records_service.create(system_identity, {"metadata": {}}).id
+    files_service.init_files(system_identity, recid, [{"key": "file.pdf"}])
+    with open(pdf_path, "rb") as pdf:
+        files_service.set_file_content(system_identity, recid, "file.pdf", pdf)
+    files_service.commit_file(system_identity, recid, "file.pdf")
+
+    with mock.patch("invenio_previewer.extensions.pdfjs.render_template"):
+        res = benchmark(client.get, f"/records/{recid}/preview/file.pdf")
+    assert res.status_code == 200
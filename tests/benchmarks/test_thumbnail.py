@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Thumbnail creation benchmarks."""
+
+import fitz
+
+from rero_invenio_files.records.engines import DocumentEngine, ImageEngine
+
+RENDITIONS = [dict(size=200, quality=95)]
+
+
+def test_pdf_thumbnail(benchmark, pdf_path):
+    """Create the thumbnail of PDF files of several number of pages."""
+    benchmark.group = "thumbnail-pdf"
+
+    def create_thumbnails():
+        with fitz.open(pdf_path) as document:
+            return DocumentEngine.create_thumbnails_from_document(document, RENDITIONS)
+
+    assert benchmark(create_thumbnails)
+
+
+def test_image_thumbnail(benchmark, image_path):
+    """Create the thumbnail of images of several resolutions."""
+    benchmark.group = "thumbnail-image"
+    assert benchmark(ImageEngine.create_thumbnails_from_image, image_path, RENDITIONS)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Command-line interface tests."""
+
+from io import BytesIO
+
+from invenio_search import current_search
+
+from rero_invenio_files.cli import regenerate_derivatives, reindex
+from rero_invenio_files.proxies import current_rero_invenio_files
+
+
+def test_reindex(app, client, headers, search_clear):
+    """Test the records reindexing."""
+    for _ in range(3):
+        res = client.post("/api/records", headers=headers, json={"metadata": {}})
+        assert res.status_code == 201
+    runner = app.test_cli_runner()
+    res = runner.invoke(reindex, ["--batch-size", "2", "--chunk-size", "2"])
+    assert res.exit_code == 0
+    assert "3 records indexed, 0 errors" in res.output
+    current_search.flush_and_refresh("*")
+    res = client.get("/api/records", headers=headers)
+    assert res.json["hits"]["total"] == 3
+
+
+def test_reindex_workers(app, client, headers, search_clear, monkeypatch):
+    """Test the records reindexing with several processes."""
+    ids = []
+    for _ in range(5):
+        res = client.post("/api/records", headers=headers, json={"metadata": {}})
+        ids.append(res.json["id"])
+    record_cls = current_rero_invenio_files.records_service.record_cls
+    total = record_cls.model_cls.query.count()
+    runner = app.test_cli_runner()
+    res = runner.invoke(reindex, ["--workers", "2", "--batch-size", "2"])
+    assert res.exit_code == 0
+    assert f"{total} records indexed, 0 errors" in res.output
+    current_search.flush_and_refresh("*")
+    res = client.get("/api/records", headers=headers)
+    assert res.json["hits"]["total"] == total
+
+    # the search documents which cannot be built are counted as errors
+    dumps = record_cls.dumps
+
+    def failing_dumps(record, **kwargs):
+        if record["id"] == ids[0]:
+            raise ValueError("cannot be dumped")
+        return dumps(record, **kwargs)
+
+    monkeypatch.setattr(record_cls, "dumps", failing_dumps)
+    res = runner.invoke(reindex, ["--workers", "2", "--batch-size", "2"])
+    assert res.exit_code == 0
+    assert f"{total - 1} records indexed, 1 errors" in res.output
+
+
+def test_regenerate_derivatives(
+    app, client, headers, file_location, pdf_file, tmp_path, monkeypatch
+):
+    """Test the regeneration of the outdated derived files."""
+    res = client.post("/api/records", headers=headers, json={"metadata": {}})
+    id_ = res.json["id"]
+    client.post(f"/api/records/{id_}/files", headers=headers, json=[{"key": "a.pdf"}])
+    client.put(
+        f"/api/records/{id_}/files/a.pdf/content",
+        headers={
+            "content-type": "application/octet-stream",
+            "accept": "application/json",
+        },
+        data=BytesIO(pdf_file),
+    )
+    client.post(f"/api/records/{id_}/files/a.pdf/commit", headers=headers)
+    runner = app.test_cli_runner()
+    res = runner.invoke(regenerate_derivatives, ["--dry-run"])
+    assert "0 files of 0 records to regenerate" in res.output
+
+    monkeypatch.setitem(app.config, "RERO_FILES_THUMBNAIL_SIZE", 100)
+    res = runner.invoke(regenerate_derivatives, ["--dry-run"])
+    assert "1 files of 1 records to regenerate" in res.output
+
+    checkpoint = tmp_path / "checkpoint"
+    res = runner.invoke(regenerate_derivatives, ["--checkpoint", str(checkpoint)])
+    assert res.exit_code == 0
+    assert "1 files regenerated, 0 errors" in res.output
+    assert not checkpoint.exists()
+    res = client.get(f"/api/records/{id_}/files", headers=headers)
+    assert len(res.json["entries"]) == 4
+    thumbnail = client.get(f"/api/records/{id_}/files/a-pdf.jpg", headers=headers).json
+    assert thumbnail["metadata"]["params"] == "thumbnail:quality=95:size=100"
+
+    res = runner.invoke(regenerate_derivatives, ["--dry-run"])
+    assert "0 files of 0 records to regenerate" in res.output
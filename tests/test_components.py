@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+#
+# RERO-Invenio-Files
+# Copyright (C) 2024 RERO.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Test the thumbnail and fulltext component."""
+
+import contextlib
+import os
+import time
+from io import BytesIO
+
+import fitz
+import mock
+import pytest
+
+from rero_invenio_files.records.components import (
+    DerivationContext,
+    ThumbnailAndFulltextComponent,
+)
+from rero_invenio_files.records.engines import (
+    DerivationEngineRegistry,
+    DocumentEngine,
+    FFmpegEngine,
+    ImageEngine,
+    OfficeEngine,
+)
+from rero_invenio_files.records.pages import PAGE_BREAK, PagedText, PageIndexer
+from rero_invenio_files.records.sandbox import DerivationError, run_in_sandbox
+from rero_invenio_files.records.streams import IterStream, LocalFile, local_path
+
+
+def test_fulltext_streaming(base_app, tmp_path, pdf_file):
+    """Test the page by page fulltext extraction."""
+    file_path = tmp_path / "test.pdf"
+    file_path.write_bytes(pdf_file)
+    with base_app.app_context():
+        # extracted by the derivation engine of the mime type
+        fulltext = ThumbnailAndFulltextComponent.create_fulltext_from_file(
+            str(file_path), "application/pdf"
+        )
+        assert "Title" in fulltext
+
+        chunks = ThumbnailAndFulltextComponent.iter_fulltext_from_file(
+            str(file_path), "application/pdf"
+        )
+        with IterStream(chunks) as stream:
+            assert stream.peek()
+            assert stream.read(5) == fulltext.encode()[:5]
+            assert stream.read() == fulltext.encode()[5:]
+            assert not stream.read()
+
+        assert not list(
+            ThumbnailAndFulltextComponent.iter_fulltext_from_file(
+                str(file_path), "image/png"
+            )
+        )
+        assert ThumbnailAndFulltextComponent.create_thumbnail_from_file(
+            str(file_path), "application/pdf", size=64
+        )
+
+
+def test_fulltext_parallel(tmp_path, pdf_file):
+    """Test the multi-processes fulltext extraction."""
+    file_path = tmp_path / "test.pdf"
+    with fitz.open(stream=pdf_file, filetype="pdf") as page_doc:
+        with fitz.open() as pdf_doc:
+            for _ in range(10):
+                pdf_doc.insert_pdf(page_doc)
+            pdf_doc.save(file_path)
+    serial = b"".join(DocumentEngine.iter_fulltext_from_file(str(file_path)))
+    parallel = b"".join(
+        DocumentEngine.iter_fulltext_from_file(
+            str(file_path), processes=3, parallel_min_pages=5
+        )
+    )
+    assert serial.count(b"Simple Title") == 10
+    assert parallel == serial
+
+
+def test_page_index():
+    """Test the page index of the fulltexts."""
+    pages = [b"First\npage", b"", "Third pâge".encode(), b"Last"]
+    content = PAGE_BREAK.join(pages)
+    # the page breaks are found across the chunks
+    indexer = PageIndexer(content[i : i + 3] for i in range(0, len(content), 3))
+    text = b"".join(indexer)
+    assert text == b"\n".join(pages)
+    index_stream = BytesIO(indexer.to_bytes())
+    paged_text = PagedText(BytesIO(text), index_stream)
+    # the page index is read once
+    index_stream.close()
+    assert paged_text.page_count == 4
+    assert [paged_text.get_page_text(number) for number in range(1, 5)] == [
+        page.decode() for page in pages
+    ]
+    with pytest.raises(IndexError):
+        paged_text.get_page_text(5)
+
+    offset = text.index(b"Third")
+    assert paged_text.find_page(0) == 1
+    assert paged_text.find_page(offset) == 3
+    assert paged_text.find_page(len(text) - 1) == 4
+    snippet = paged_text.get_snippet(offset + 2, size=4)
+    # the snippet stays in its page, the cut characters are ignored
+    assert snippet == dict(page=3, start=offset, stop=offset + 6, text="Third ")
+    with pytest.raises(IndexError):
+        paged_text.find_page(len(text))
+
+
+def test_thumbnail_decoding_limits(tmp_path):
+    """Test the large images thumbnails."""
+    pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 2000, 1500), False)
+    pixmap.clear_with(200)
+    jpg_path = tmp_path / "large.jpg"
+    png_path = tmp_path / "large.png"
+    pixmap.save(jpg_path)
+    pixmap.save(png_path)
+    renditions = [dict(size=200, quality=80)]
+
+    # the jpeg image is decoded at a quarter of its size
+    [thumbnail] = ImageEngine.create_thumbnails_from_image(
+        str(jpg_path), renditions, max_pixels=1_000_000
+    )
+    assert fitz.Pixmap(thumbnail).width == 200
+    with pytest.raises(ValueError):
+        ImageEngine.create_thumbnails_from_image(
+            str(png_path), renditions, max_pixels=1_000_000
+        )
+    [thumbnail] = ImageEngine.create_thumbnails_from_image(
+        str(png_path), renditions, memory_limit=100 * 1024 * 1024
+    )
+    assert fitz.Pixmap(thumbnail).width == 200
+
+
+def test_local_file(tmp_path, pdf_file):
+    """Test the local access to the stored files."""
+
+    class RemoteFileRecord:
+        """File record on an object storage."""
+
+        key = "test.pdf"
+        file = mock.Mock(uri="s3://bucket/test.pdf")
+        reads = 0
+
+        @contextlib.contextmanager
+        def open_stream(self, mode):
+            self.reads += 1
+            yield BytesIO(pdf_file)
+
+    file_record = RemoteFileRecord()
+    with LocalFile(file_record):
+        pass
+    assert file_record.reads == 0
+
+    with LocalFile(file_record) as local_file:
+        path = local_file.path
+        assert path.endswith(".pdf")
+        assert local_file.path == path
+        with open(path, "rb") as stream:
+            assert stream.read() == pdf_file
+    assert file_record.reads == 1
+    assert not os.path.exists(path)
+
+    # the local files are used in place
+    file_path = tmp_path / "test.pdf"
+    file_path.write_bytes(pdf_file)
+    file_record.file = mock.Mock(uri=str(file_path))
+    with local_path(file_record) as path:
+        assert path == str(file_path)
+    assert file_record.reads == 1
+
+
+def test_derivation_context(tmp_path, pdf_file):
+    """Test the pdf document shared by the derivation steps."""
+    file_path = tmp_path / "test.pdf"
+    file_path.write_bytes(pdf_file)
+    file_record = mock.Mock(key="test.pdf", file=mock.Mock(uri=str(file_path)))
+    with DerivationContext(file_record) as context:
+        document = context.document
+        assert context.document is document
+        assert context.page_count == 1
+        assert "producer" in context.metadata
+        fulltext = b"".join(
+            DocumentEngine.iter_fulltext_from_file(context.path, document=document)
+        )
+        assert b"Title" in fulltext
+        assert DocumentEngine.create_thumbnails_from_document(
+            document, [dict(size=64, quality=80)]
+        )
+        # the shared document is kept open
+        assert not document.is_closed
+    assert document.is_closed
+
+
+def test_derivation_engine_registry():
+    """Test the derivation engines selection by mime type."""
+    registry = DerivationEngineRegistry()
+    for engine in [DocumentEngine, ImageEngine, OfficeEngine, FFmpegEngine]:
+        registry.register(engine())
+    assert registry.get("application/pdf").name == "document"
+    assert registry.get("application/epub+zip").name == "document"
+    assert registry.get("image/tiff").name == "image"
+    office = registry.get("application/vnd.oasis.opendocument.text")
+    assert office.name == "office"
+    assert office.cost == "expensive"
+    assert registry.get("video/mp4").name == "ffmpeg"
+    assert registry.get("application/zip") is None
+    assert registry.get(None) is None
+
+
+def test_derivation_sandbox():
+    """Test the derivation steps running with limited resources."""
+    assert run_in_sandbox(sum, [1, 2], timeout=10) == 3
+
+    with pytest.raises(DerivationError, match="ZeroDivisionError"):
+        run_in_sandbox(divmod, 1, 0, timeout=10)
+
+    with pytest.raises(DerivationError, match="timeout after 0.2s"):
+        run_in_sandbox(time.sleep, 10, timeout=0.2)
+
+    def allocate():
+        data = b"x" * 256 * 1024 * 1024
+        time.sleep(10)
+        return len(data)
+
+    with pytest.raises(DerivationError, match="memory limit"):
+        run_in_sandbox(allocate, memory_limit=64 * 1024 * 1024, timeout=10)
+
+    def spin():
+        while True:
+            pass
+
+    with pytest.raises(DerivationError, match="CPU time limit exceeded"):
+        run_in_sandbox(spin, cpu_limit=1, timeout=10)
@@ -17,7 +17,25 @@
 
 """Test PDF Generator."""
 
-from rero_invenio_files.pdf import PDFGenerator
+import os
+from io import BytesIO
+
+import fitz
+from fpdf import FPDF
+from fpdf.fonts import TTFFont
+from fpdf.output import PDFFontStream
+from fpdf.syntax import PDFContentStream
+
+from rero_invenio_files.pdf import (
+    FONT_DIR,
+    FONTS,
+    PDFGenerator,
+    PDFOutputProducer,
+    copy_font,
+    load_font,
+    render_pdf,
+    render_pdfs,
+)
 
 
 def test_pdf_generation(simple_data):
@@ -25,3 +43,159 @@ def test_pdf_generation(simple_data):
     pdf = PDFGenerator(simple_data)
     pdf.render()
     assert pdf.output()
+
+
+def test_linearized_pdf_generation(simple_data, tmp_path):
+    """Test the linearized pdf generation."""
+    pdf = PDFGenerator(simple_data)
+    pdf.render()
+    content = pdf.output(linearize=True)
+    with fitz.open(stream=content, filetype="pdf") as document:
+        assert document.is_fast_webaccess
+
+    pdf = PDFGenerator(simple_data)
+    pdf.render()
+    file_path = tmp_path / "linearized.pdf"
+    assert pdf.output(str(file_path), linearize=True) is None
+    with fitz.open(file_path) as document:
+        assert document.is_fast_webaccess
+
+
+def test_fpdf2_internals():
+    """Test the fpdf2 internals used to copy the parsed fonts.
+
+    A new fpdf2 version changing them must be checked before being allowed.
+    """
+    _, style, fname = FONTS[0]
+    fname = os.path.join(FONT_DIR, fname)
+    font = TTFFont(FPDF(), fname, "notosans", style)
+    # the parsed font is not changed by the output of a document
+    pdf = PDFGenerator({})
+    pdf.render()
+    pdf.output()
+    copied = copy_font(FPDF(), fname, "notosans", style)
+    # all the font attributes are copied, but the harfbuzz font
+    assert {name for name in TTFFont.__slots__ if hasattr(font, name)} - {"hbfont"} == {
+        name for name in TTFFont.__slots__ if hasattr(copied, name)
+    }
+    assert vars(copied.desc) == vars(font.desc)
+    for name in ["cw", "glyph_ids", "scale", "up", "ut"]:
+        assert getattr(copied, name) == getattr(font, name)
+    assert copied.subset.pick(ord("A")) == font.subset.pick(ord("A"))
+
+
+def test_fpdf2_output_internals(simple_data):
+    """Test the fpdf2 internals used by the size options.
+
+    A new fpdf2 version changing them must be checked before being allowed.
+    """
+    streams = []
+
+    class OutputProducer(PDFOutputProducer):
+        def optimize_stream(self, pdf_obj):
+            streams.append(pdf_obj)
+            super().optimize_stream(pdf_obj)
+
+    pdf = PDFGenerator(simple_data, strip_fonts=True, compression_level=9)
+    pdf.render()
+    pdf.output(output_producer_class=OutputProducer)
+    font_streams = [stream for stream in streams if isinstance(stream, PDFFontStream)]
+    assert len(font_streams) == 2
+    for stream in font_streams:
+        assert {"_contents", "filter", "length", "length1"} <= set(vars(stream))
+    assert isinstance(PDFContentStream._COMPRESSION_LEVEL, int)
+
+
+def test_pdf_batch_generation(simple_data):
+    """Test the generation of several pdf files."""
+    data_list = [dict(simple_data, title=f"Title {number}") for number in range(3)]
+    for processes in [1, 2]:
+        contents = list(render_pdfs(data_list, processes=processes, chunk_size=2))
+        assert len(contents) == 3
+        for number, content in enumerate(contents):
+            with fitz.open(stream=content, filetype="pdf") as document:
+                assert f"Title {number}" in document[0].get_text()
+    # the fonts are parsed once
+    assert load_font.cache_info().currsize == 2
+
+    # the data are read as the files are consumed
+    read = []
+
+    def iter_data():
+        for number in range(100):
+            read.append(number)
+            yield dict(simple_data, title=f"Title {number}")
+
+    contents = render_pdfs(iter_data(), processes=2, chunk_size=2)
+    next(contents)
+    assert len(read) <= 2 * 2 * 2 + 2
+    contents.close()
+
+    pdf = PDFGenerator.render_collection(data_list)
+    with fitz.open(stream=pdf.output(), filetype="pdf") as document:
+        assert document.page_count == 3
+        for number, page in enumerate(document):
+            assert f"Title {number}" in page.get_text()
+
+
+def test_pdf_collection_page_numbers(simple_data):
+    """Test the page numbers of the data rendered in a single document."""
+    data_list = [
+        simple_data,
+        dict(simple_data, summary=simple_data["summary"] * 8),
+        simple_data,
+    ]
+    pdf = PDFGenerator.render_collection(data_list)
+    with fitz.open(stream=pdf.output(), filetype="pdf") as document:
+        assert [page.get_text().strip().splitlines()[-1] for page in document] == [
+            "Page 1/1",
+            "Page 1/2",
+            "Page 2/2",
+            "Page 1/1",
+        ]
+
+
+def test_pdf_stream_output(simple_data, tmp_path):
+    """Test the pdf generation to a stream."""
+    pdf = PDFGenerator(simple_data)
+    pdf.render()
+    content = bytes(pdf.output())
+
+    pdf = PDFGenerator(simple_data)
+    pdf.render()
+    file_path = tmp_path / "stream.pdf"
+    with open(file_path, "wb") as stream:
+        size = pdf.output_to_stream(stream)
+    assert size == file_path.stat().st_size == len(content)
+    with fitz.open(file_path) as document:
+        assert document.page_count == 1
+        assert "Simple Title" in document[0].get_text()
+
+    pdf = PDFGenerator(simple_data)
+    pdf.render()
+    stream = BytesIO()
+    assert pdf.output_to_stream(stream, linearize=True) == len(stream.getvalue())
+    with fitz.open(stream=stream.getvalue(), filetype="pdf") as document:
+        assert document.is_fast_webaccess
+
+
+def test_pdf_size_options(simple_data):
+    """Test the size options of the pdf generation."""
+    default = render_pdf(simple_data)
+    with fitz.open(stream=default, filetype="pdf") as document:
+        pixmap = document[0].get_pixmap(dpi=72)
+
+    options = dict(strip_fonts=True, compression_level=9, object_streams=True)
+    content = render_pdf(simple_data, **options)
+    assert len(content) < len(default)
+    with fitz.open(stream=content, filetype="pdf") as document:
+        assert "Simple Title" in document[0].get_text()
+        # the same glyphs are rendered
+        assert document[0].get_pixmap(dpi=72).samples == pixmap.samples
+    content = render_pdf(simple_data, linearize=True, **options)
+    with fitz.open(stream=content, filetype="pdf") as document:
+        assert document.is_fast_webaccess
+
+    content = render_pdf(simple_data, compression_level=0)
+    assert b"FlateDecode" not in content
+    assert len(content) > len(default)
@@ -17,12 +17,28 @@
 
 """Module tests."""
 
+import time
+from datetime import timedelta
 from io import BytesIO
 
+import fitz
 import mock
+import pytest
 from flask import Flask
+from invenio_access.permissions import system_identity
+from invenio_db import db
+from invenio_files_rest.models import FileInstance
 
 from rero_invenio_files import REROInvenioFiles
+from rero_invenio_files.pdf import PDFGenerator
+from rero_invenio_files.records.engines import TextEngine, is_image_format_supported
+from rero_invenio_files.records.metrics import (
+    InMemoryInstrumentation,
+    Measurement,
+    PrometheusInstrumentation,
+)
+from rero_invenio_files.records.models import DerivativeCacheMetadata
+from rero_invenio_files.records.pages import PageNotFoundError
 
 
 def test_version():
@@ -113,7 +129,7 @@ def test_files_api_flow(client, headers, file_location, pdf_file):
     assert res.status_code == 200
     assert res.json["key"] == "test.pdf"
     assert res.json["status"] == "completed"
-    assert res.json["metadata"] == {"label": "label1"}
+    assert res.json["metadata"] == {"label": "label1", "derivation_status": "done"}
     file_size = str(res.json["size"])
     assert set(res.json["links"].keys()) == {
         "self",
@@ -162,11 +178,12 @@ def test_files_api_flow(client, headers, file_location, pdf_file):
     # Get all files
     res = client.get(f"/api/records/{id_}/files", headers=headers)
     assert res.status_code == 200
-    assert len(res.json["entries"]) == 3
+    assert len(res.json["entries"]) == 4
     main_file = [
         file
         for file in res.json["entries"]
-        if file.get("metadata", {}).get("type") not in ["thumbnail", "fulltext"]
+        if file.get("metadata", {}).get("type")
+        not in ["thumbnail", "fulltext", "pages"]
     ][0]
     assert main_file["key"] == "test.pdf"
     assert main_file["status"] == "completed"
@@ -180,3 +197,580 @@ def test_files_api_flow(client, headers, file_location, pdf_file):
     res = client.get(f"/api/records/{id_}/files", headers=headers)
     assert res.status_code == 200
     assert len(res.json["entries"]) == 0
+
+
+def create_record_with_file(client, headers, key, content):
+    """Create a record and upload a file."""
+    res = client.post("/api/records", headers=headers, json={"metadata": {}})
+    id_ = res.json["id"]
+    client.post(f"/api/records/{id_}/files", headers=headers, json=[{"key": key}])
+    client.put(
+        f"/api/records/{id_}/files/{key}/content",
+        headers={
+            "content-type": "application/octet-stream",
+            "accept": "application/json",
+        },
+        data=BytesIO(content),
+    )
+    res = client.post(f"/api/records/{id_}/files/{key}/commit", headers=headers)
+    assert res.status_code == 200
+    return id_, res.json
+
+
+def test_files_async_derivation(
+    app, client, headers, file_location, pdf_file, monkeypatch
+):
+    """Test the thumbnail and fulltext creation in a background task."""
+    monkeypatch.setitem(app.config, "RERO_FILES_DERIVATION_ASYNC", True)
+    id_, res_file = create_record_with_file(client, headers, "test.pdf", pdf_file)
+    # the task is queued after the commit
+    assert res_file["metadata"] == {"derivation_status": "pending"}
+
+    # celery tasks are eager during the tests
+    res = client.get(f"/api/records/{id_}/files/test.pdf", headers=headers)
+    assert res.json["metadata"] == {"derivation_status": "done"}
+    res = client.get(f"/api/records/{id_}/files", headers=headers)
+    assert len(res.json["entries"]) == 4
+
+    # an unexpected error does not leave the file pending
+    with mock.patch(
+        "rero_invenio_files.records.components.ThumbnailAndFulltextComponent"
+        ".create_derivatives",
+        side_effect=RuntimeError("unexpected"),
+    ):
+        id_, _ = create_record_with_file(client, headers, "test.pdf", pdf_file)
+    res = client.get(f"/api/records/{id_}/files/test.pdf", headers=headers)
+    assert res.json["metadata"] == {
+        "derivation_status": "failed",
+        "derivation_error": "RuntimeError: unexpected",
+    }
+
+
+def test_derivative_cache(app, client, headers, file_location, pdf_file, monkeypatch):
+    """Test the derived files reuse for identical files."""
+    monkeypatch.setitem(app.config, "RERO_FILES_DERIVATIVE_CACHE_SIZE", 10000)
+    cache = app.extensions["rero-invenio-files"].derivative_cache
+    id1, _ = create_record_with_file(client, headers, "doc.pdf", pdf_file)
+    hits = cache.hits
+    id2, _ = create_record_with_file(client, headers, "doc.pdf", pdf_file)
+    # thumbnail, fulltext and page index
+    assert cache.hits == hits + 3
+    thumb1 = client.get(f"/api/records/{id1}/files/doc-pdf.jpg", headers=headers)
+    thumb2 = client.get(f"/api/records/{id2}/files/doc-pdf.jpg", headers=headers)
+    assert thumb1.json["file_id"] == thumb2.json["file_id"]
+    res = client.get(f"/api/records/{id2}/files/doc-pdf.txt/content", headers=headers)
+    assert "Title" in res.text
+    assert cache.stats()["size"] >= 2
+
+    # the hits are stored with the access time at most once per interval
+    checksum = client.get(f"/api/records/{id1}/files/doc.pdf").json["checksum"]
+    entries = DerivativeCacheMetadata.query.filter_by(checksum=checksum)
+    assert not any(entry.hits for entry in entries)
+    monkeypatch.setattr(cache, "touch_interval", timedelta(0))
+    create_record_with_file(client, headers, "doc.pdf", pdf_file)
+    assert [entry.hits for entry in entries] == [2] * entries.count()
+
+    # an entry added by a concurrent derivation is updated
+    thumbnail = FileInstance.query.get(thumb1.json["file_id"])
+    text = FileInstance.query.get(
+        client.get(f"/api/records/{id1}/files/doc-pdf.txt").json["file_id"]
+    )
+    assert cache.set(checksum, thumbnail, "test", size=1) == []
+    assert cache.set(checksum, text, "test", size=1) == [("test:size=1", thumbnail.id)]
+    entry = DerivativeCacheMetadata.query.filter_by(
+        checksum=checksum, params="test:size=1"
+    ).one()
+    assert entry.file_id == text.id
+    db.session.rollback()
+
+
+def test_files_bulk_upload(client, headers, file_location, pdf_file):
+    """Test the upload of several files at once."""
+    res = client.post("/api/records", headers=headers, json={"metadata": {}})
+    id_ = res.json["id"]
+    res = client.post(
+        f"/api/records/{id_}/files-upload",
+        headers={"accept": "application/json"},
+        data={"file": [(BytesIO(pdf_file), "a.pdf"), (BytesIO(pdf_file), "b.pdf")]},
+        content_type="multipart/form-data",
+    )
+    assert res.status_code == 201
+    res = client.get(f"/api/records/{id_}/files", headers=headers)
+    keys = {entry["key"]: entry for entry in res.json["entries"]}
+    assert set(keys) == {
+        "a.pdf",
+        "a-pdf.jpg",
+        "a-pdf.txt",
+        "a-pdf.txt.idx",
+        "b.pdf",
+        "b-pdf.jpg",
+        "b-pdf.txt",
+        "b-pdf.txt.idx",
+    }
+    assert keys["b.pdf"]["status"] == "completed"
+    assert keys["b.pdf"]["metadata"] == {"derivation_status": "done"}
+
+
+def test_fulltext_indexing(app, client, headers, file_location, pdf_file, monkeypatch):
+    """Test the fulltext in the search document."""
+    id_, _ = create_record_with_file(client, headers, "test.pdf", pdf_file)
+    record_cls = app.extensions["rero-invenio-files"].records_service.record_cls
+    record = record_cls.pid.resolve(id_)
+    dump = record.dumps()
+    assert "Title" in "".join(dump["fulltext"])
+    assert "fulltext" not in record_cls.loads(dump)
+
+    # the fulltext is truncated
+    monkeypatch.setitem(app.config, "RERO_FILES_FULLTEXT_INDEX_MAX_SIZE", 10)
+    assert "".join(record.dumps()["fulltext"]) == "Document p"
+
+
+def test_fulltext_indexing_pages(
+    app, client, headers, file_location, simple_data, monkeypatch
+):
+    """Test the fulltext chunks made of pages in the search document."""
+    service = app.extensions["rero-invenio-files"].records_files_service
+    data_list = [dict(simple_data, title=f"Title {number}") for number in range(1, 4)]
+    pdf = PDFGenerator.render_collection(data_list)
+    id_, _ = create_record_with_file(client, headers, "book.pdf", pdf.output())
+    pages = [
+        service.get_page_text(system_identity, id_, "book.pdf", number)
+        for number in range(1, 4)
+    ]
+    record_cls = app.extensions["rero-invenio-files"].records_service.record_cls
+    record = record_cls.pid.resolve(id_)
+    # the small pages are merged
+    assert record.dumps()["fulltext"] == ["\n".join(pages)]
+    # one page per chunk
+    monkeypatch.setitem(
+        app.config,
+        "RERO_FILES_FULLTEXT_INDEX_CHUNK_SIZE",
+        max(len(page.encode()) for page in pages) + 1,
+    )
+    assert [chunk.rstrip("\n") for chunk in record.dumps()["fulltext"]] == pages
+
+
+def test_thumbnail_renditions(
+    app, client, headers, file_location, pdf_file, monkeypatch
+):
+    """Test the thumbnails of several sizes."""
+    monkeypatch.setitem(app.config, "RERO_FILES_THUMBNAIL_RENDITIONS", [64, 800])
+    id_, res_file = create_record_with_file(client, headers, "test.pdf", pdf_file)
+    assert set(res_file["links"]["thumbnails"]) == {"64", "200", "800"}
+    assert res_file["links"]["thumbnails"]["200"] == res_file["links"]["thumbnail"]
+    res = client.get(f"/api/records/{id_}/files", headers=headers)
+    keys = {entry["key"] for entry in res.json["entries"]}
+    assert keys == {
+        "test.pdf",
+        "test-pdf.jpg",
+        "test-pdf.64.jpg",
+        "test-pdf.800.jpg",
+        "test-pdf.txt",
+        "test-pdf.txt.idx",
+    }
+    url = f"/api/records/{id_}/files/test-pdf.64.jpg/content"
+    assert res_file["links"]["thumbnails"]["64"].endswith(url)
+    res = client.get(url, headers=headers)
+    assert res.status_code == 200
+
+    # all the derived files are removed with the original file
+    client.delete(f"/api/records/{id_}/files/test.pdf", headers=headers)
+    res = client.get(f"/api/records/{id_}/files", headers=headers)
+    assert res.json["entries"] == []
+
+
+def test_thumbnail_formats(app, client, headers, file_location, pdf_file, monkeypatch):
+    """Test the thumbnails in other formats and the content negotiation."""
+    if not is_image_format_supported("webp"):
+        pytest.skip("webp is not supported by ImageMagick")
+    monkeypatch.setitem(app.config, "RERO_FILES_THUMBNAIL_FORMATS", {"webp": 80})
+    monkeypatch.setitem(app.config, "RERO_FILES_THUMBNAIL_MAX_DISTORTION", 0.05)
+    id_, _ = create_record_with_file(client, headers, "test.pdf", pdf_file)
+    res = client.get(f"/api/records/{id_}/files/test-pdf.webp", headers=headers)
+    assert res.json["metadata"]["params"] == (
+        "thumbnail:format=webp:max_distortion=0.05:quality=80:size=200"
+    )
+
+    url = f"/api/records/{id_}/files/test-pdf.jpg/content"
+    res = client.get(url, headers={"accept": "image/webp,*/*"})
+    assert res.status_code == 200
+    assert res.mimetype == "image/webp"
+    assert res.vary.contains("Accept")
+    res = client.get(url, headers={"accept": "*/*"})
+    assert res.mimetype == "image/jpeg"
+    # the quality values of the client are used
+    res = client.get(url, headers={"accept": "image/webp;q=0,*/*"})
+    assert res.mimetype == "image/jpeg"
+    res = client.get(url, headers={"accept": "image/jpeg,image/webp;q=0.5"})
+    assert res.mimetype == "image/jpeg"
+    res = client.get(url, headers={"accept": "image/jpeg;q=0.5,image/webp"})
+    assert res.mimetype == "image/webp"
+
+    # the uploaded jpg files are not negotiated
+    with fitz.open(stream=pdf_file, filetype="pdf") as document:
+        image = document[0].get_pixmap().tobytes("jpg")
+    id_, _ = create_record_with_file(client, headers, "photo.jpg", image)
+    res = client.get(
+        f"/api/records/{id_}/files/photo.jpg/content",
+        headers={"accept": "image/webp,*/*"},
+    )
+    assert res.mimetype == "image/jpeg"
+    assert not res.vary.contains("Accept")
+
+
+def test_expensive_derivation_engine(app, client, headers, file_location, monkeypatch):
+    """Test the derivation engines running in a background task."""
+
+    class SlowTextEngine(TextEngine):
+        """Expensive plain text engine."""
+
+        cost = "expensive"
+
+    registry = app.extensions["rero-invenio-files"].derivation_engines
+    monkeypatch.setattr(registry, "_engines", [SlowTextEngine(), *registry])
+    monkeypatch.setitem(
+        app.config, "RERO_FILES_DERIVATION_QUEUES", {"expensive": "slow"}
+    )
+    id_, res_file = create_record_with_file(client, headers, "test.txt", b"Some text")
+    # the task is queued after the commit
+    assert res_file["metadata"] == {"derivation_status": "pending"}
+
+    # celery tasks are eager during the tests
+    res = client.get(f"/api/records/{id_}/files/test.txt", headers=headers)
+    assert res.json["metadata"] == {"derivation_status": "done"}
+    res = client.get(f"/api/records/{id_}/files/test-txt.txt/content", headers=headers)
+    assert res.data == b"Some text"
+
+
+def test_derivation_limits(app, client, headers, file_location, monkeypatch):
+    """Test the derivations stopped by the resource limits."""
+
+    class StallingTextEngine(TextEngine):
+        """Plain text engine which never ends."""
+
+        def iter_fulltext(self, context, mimetype):
+            """Wait forever."""
+            time.sleep(60)
+            yield b"never"
+
+    registry = app.extensions["rero-invenio-files"].derivation_engines
+    monkeypatch.setattr(registry, "_engines", [StallingTextEngine(), *registry])
+    monkeypatch.setitem(app.config, "RERO_FILES_DERIVATION_TIMEOUT", 0.5)
+    id_, res_file = create_record_with_file(client, headers, "test.txt", b"Some text")
+    assert res_file["metadata"] == {
+        "derivation_status": "failed",
+        "derivation_error": "fulltext: timeout after 0.5s",
+    }
+    res = client.get(f"/api/records/{id_}/files/test-txt.txt", headers=headers)
+    assert res.status_code == 404
+
+    # the limits do not change a successful derivation
+    monkeypatch.setattr(registry, "_engines", [TextEngine(), *registry])
+    id_, res_file = create_record_with_file(client, headers, "test.txt", b"Some text")
+    assert res_file["metadata"] == {"derivation_status": "done"}
+    res = client.get(f"/api/records/{id_}/files/test-txt.txt/content", headers=headers)
+    assert res.data == b"Some text"
+
+
+def test_derivation_instrumentation(
+    app, client, headers, file_location, pdf_file, monkeypatch
+):
+    """Test the measurements of the derivation steps."""
+
+    class FailingTextEngine(TextEngine):
+        """Plain text engine which always fails."""
+
+        def iter_fulltext(self, context, mimetype):
+            """Fail."""
+            raise ValueError("Broken text")
+
+    instrumentation = InMemoryInstrumentation()
+    ext = app.extensions["rero-invenio-files"]
+    monkeypatch.setattr(ext, "derivation_instrumentations", [instrumentation])
+    # the derived files are created, not taken from the cache
+    monkeypatch.setitem(app.config, "RERO_FILES_DERIVATIVE_CACHE_SIZE", 0)
+    create_record_with_file(client, headers, "test.pdf", pdf_file)
+    measurements = {m.step: m for m in instrumentation.measurements}
+    assert set(measurements) == {"thumbnail", "fulltext"}
+    for measurement in measurements.values():
+        assert measurement.mimetype == "application/pdf"
+        assert measurement.status == "done"
+        assert measurement.input_bytes == len(pdf_file)
+        assert measurement.page_count == 1
+        assert measurement.output_bytes > 0
+        assert measurement.duration > 0
+
+    instrumentation.clear()
+    registry = ext.derivation_engines
+    monkeypatch.setattr(registry, "_engines", [FailingTextEngine(), *registry])
+    create_record_with_file(client, headers, "test.txt", b"Some text")
+    [measurement] = instrumentation.measurements
+    assert measurement.attributes() == {
+        "step": "fulltext",
+        "mimetype": "text/plain",
+        "status": "failed",
+        "input_bytes": 9,
+        "duration": measurement.duration,
+        "error": "Broken text",
+        "error_type": "ValueError",
+    }
+
+
+def test_prometheus_instrumentation():
+    """Test the derivation Prometheus metrics."""
+    prometheus_client = pytest.importorskip("prometheus_client")
+    registry = prometheus_client.CollectorRegistry()
+    instrumentation = PrometheusInstrumentation(registry)
+    measurement = Measurement("thumbnail", "image/png", 2048)
+    with pytest.raises(ValueError):
+        with instrumentation.measure(measurement):
+            measurement.duration = 0.5
+            measurement.error_type = "ValueError"
+            raise ValueError("Broken image")
+    labels = dict(step="thumbnail", mimetype="image/png")
+    assert (
+        registry.get_sample_value(
+            "rero_files_derivation_duration_seconds_sum",
+            dict(status="failed", **labels),
+        )
+        == 0.5
+    )
+    assert (
+        registry.get_sample_value(
+            "rero_files_derivation_failures_total", dict(reason="ValueError", **labels)
+        )
+        == 1
+    )
+
+
+def test_content_caching(app, client, headers, file_location, pdf_file):
+    """Test the cache headers, conditional and range requests on contents."""
+    id_, _ = create_record_with_file(client, headers, "test.pdf", pdf_file)
+    url = f"/api/records/{id_}/files/test.pdf/content"
+    res = client.get(url)
+    assert res.status_code == 200
+    assert res.headers["Accept-Ranges"] == "bytes"
+    assert res.cache_control.private
+    assert res.cache_control.max_age == 0
+    etag, _ = res.get_etag()
+    assert etag.startswith("md5:")
+    last_modified = res.headers["Last-Modified"]
+
+    res = client.get(url, headers={"If-None-Match": f'"{etag}"'})
+    assert res.status_code == 304
+    assert not res.data
+    res = client.get(url, headers={"If-Modified-Since": last_modified})
+    assert res.status_code == 304
+
+    res = client.get(url, headers={"Range": "bytes=0-9"})
+    assert res.status_code == 206
+    assert res.data == pdf_file[:10]
+    assert res.headers["Content-Range"] == f"bytes 0-9/{len(pdf_file)}"
+    res = client.get(url, headers={"Range": f"bytes={len(pdf_file)}-"})
+    assert res.status_code == 416
+
+    # the derived files are cached longer
+    res = client.get(f"/api/records/{id_}/files/test-pdf.jpg/content")
+    assert res.status_code == 200
+    assert res.cache_control.max_age == 24 * 60 * 60
+
+
+def presigned_url(file_instance, expires):
+    """Presigned URL of a file for the tests."""
+    return f"https://storage.example.org/{file_instance.id}?expires={expires}"
+
+
+def test_content_offload(app, client, headers, file_location, pdf_file, monkeypatch):
+    """Test the file content transfers handed over to the front proxy."""
+    id_, _ = create_record_with_file(client, headers, "test.pdf", pdf_file)
+    url = f"/api/records/{id_}/files/test.pdf/content"
+    streamed = client.get(url)
+
+    monkeypatch.setitem(app.config, "RERO_FILES_CONTENT_OFFLOAD", "x-sendfile")
+    res = client.get(url)
+    assert res.status_code == 200
+    assert not res.data
+    for header in ["Content-Type", "Content-Disposition", "ETag", "Last-Modified"]:
+        assert res.headers[header] == streamed.headers[header]
+    with open(res.headers["X-Sendfile"], "rb") as stored_file:
+        assert stored_file.read() == pdf_file
+    # the ranges are served by the proxy
+    res = client.get(url, headers={"Range": "bytes=0-9"})
+    assert res.status_code == 200
+    assert "X-Sendfile" in res.headers
+
+    monkeypatch.setitem(app.config, "RERO_FILES_CONTENT_OFFLOAD", "x-accel-redirect")
+    res = client.get(url)
+    assert res.status_code == 200
+    assert "X-Accel-Redirect" not in res.headers
+    assert res.data == pdf_file
+    monkeypatch.setitem(
+        app.config,
+        "RERO_FILES_CONTENT_OFFLOAD_LOCATIONS",
+        {file_location.uri: "/files"},
+    )
+    res = client.get(url)
+    assert res.headers["X-Accel-Redirect"].startswith("/files/")
+    assert res.headers["X-Accel-Redirect"].endswith("/data")
+    etag = res.headers["ETag"]
+    res = client.get(url, headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert "X-Accel-Redirect" not in res.headers
+
+    monkeypatch.setitem(app.config, "RERO_FILES_CONTENT_OFFLOAD", "redirect")
+    res = client.get(url)
+    assert res.status_code == 200
+    monkeypatch.setitem(
+        app.config, "RERO_FILES_CONTENT_PRESIGNED_URL_FACTORY", presigned_url
+    )
+    res = client.get(url)
+    assert res.status_code == 302
+    assert res.location.startswith("https://storage.example.org/")
+    assert res.location.endswith("?expires=60")
+
+    # the files are still resolved by the service
+    res = client.get(f"/api/records/{id_}/files/missing.pdf/content")
+    assert res.status_code == 404
+
+
+def test_linearized_pdf(
+    app, client, headers, file_location, pdf_file, simple_data, monkeypatch
+):
+    """Test the linearized copies of the pdf files."""
+    monkeypatch.setitem(app.config, "RERO_FILES_PDF_LINEARIZE", True)
+    id_, res_file = create_record_with_file(client, headers, "test.pdf", pdf_file)
+    assert res_file["metadata"] == {"derivation_status": "done"}
+    res = client.get(f"/api/records/{id_}/files/test-pdf.linear.pdf", headers=headers)
+    assert res.json["metadata"]["linearized_for"] == "test.pdf"
+
+    # the linearized copy is sent instead of the original file
+    streamed = client.get(f"/api/records/{id_}/files/test.pdf/content")
+    assert streamed.data != pdf_file
+    with fitz.open(stream=streamed.data, filetype="pdf") as document:
+        assert document.is_fast_webaccess
+        assert document.page_count == 1
+    assert "filename=test.pdf" in streamed.headers["Content-Disposition"]
+    res = client.get(f"/api/records/{id_}/files/test-pdf.linear.pdf/content")
+    assert res.data == streamed.data
+
+    # the copy is deleted with the original file
+    client.delete(f"/api/records/{id_}/files/test.pdf", headers=headers)
+    res = client.get(f"/api/records/{id_}/files", headers=headers)
+    assert res.json["entries"] == []
+
+    # no copy of an already linearized pdf
+    pdf = PDFGenerator(simple_data)
+    pdf.render()
+    id_, _ = create_record_with_file(
+        client, headers, "linear.pdf", pdf.output(linearize=True)
+    )
+    res = client.get(f"/api/records/{id_}/files", headers=headers)
+    assert {entry["key"] for entry in res.json["entries"]} == {
+        "linear.pdf",
+        "linear-pdf.jpg",
+        "linear-pdf.txt",
+        "linear-pdf.txt.idx",
+    }
+
+
+def test_create_pdf_file(app, client, headers, file_location, simple_data, monkeypatch):
+    """Test the generation of a pdf file by the file service."""
+    service = app.extensions["rero-invenio-files"].records_files_service
+    res = client.post("/api/records", headers=headers, json={"metadata": {}})
+    id_ = res.json["id"]
+    # spooled to a temporary file
+    monkeypatch.setitem(app.config, "RERO_FILES_PDF_SPOOL_SIZE", 1024)
+    item = service.create_pdf_file(
+        system_identity, id_, "report.pdf", simple_data, metadata={"type": "report"}
+    ).to_dict()
+    assert item["key"] == "report.pdf"
+    assert item["status"] == "completed"
+    assert item["metadata"]["type"] == "report"
+    assert item["metadata"]["derivation_status"] == "done"
+
+    res = client.get(f"/api/records/{id_}/files/report.pdf/content")
+    assert len(res.data) == item["size"]
+    with fitz.open(stream=res.data, filetype="pdf") as document:
+        assert "Simple Title" in document[0].get_text()
+    res = client.get(f"/api/records/{id_}/files/report-pdf.txt/content")
+    assert "Simple Title" in res.text
+
+
+def test_page_text(app, client, headers, file_location, simple_data):
+    """Test the text of the pages of a fulltext."""
+    service = app.extensions["rero-invenio-files"].records_files_service
+    data_list = [dict(simple_data, title=f"Title {number}") for number in range(1, 4)]
+    pdf = PDFGenerator.render_collection(data_list)
+    id_, _ = create_record_with_file(client, headers, "book.pdf", pdf.output())
+    res = client.get(f"/api/records/{id_}/files/book-pdf.txt.idx", headers=headers)
+    assert res.json["metadata"]["pages_for"] == "book.pdf"
+
+    assert "Title 2" in service.get_page_text(system_identity, id_, "book.pdf", 2)
+    with pytest.raises(PageNotFoundError):
+        service.get_page_text(system_identity, id_, "book.pdf", 4)
+
+    text = client.get(f"/api/records/{id_}/files/book-pdf.txt/content").data
+    offset = text.index(b"Title 3")
+    snippet = service.get_text_snippet(system_identity, id_, "book.pdf", offset, 20)
+    assert snippet["page"] == 3
+    assert "Title 3" in snippet["text"]
+    assert snippet["start"] >= offset - 20
+    assert text[snippet["start"] : snippet["stop"]].decode() == snippet["text"]
+
+
+def test_pages_api(app, client, headers, file_location, simple_data, monkeypatch):
+    """Test the page images and texts rendered on demand."""
+    monkeypatch.setitem(app.config, "RERO_FILES_DERIVATIVE_CACHE_SIZE", 10000)
+    monkeypatch.setitem(app.config, "RERO_FILES_PAGE_IMAGE_CACHE_SIZE", 10000)
+    ext = app.extensions["rero-invenio-files"]
+    cache = ext.page_image_cache
+    data_list = [dict(simple_data, title=f"Title {number}") for number in range(1, 4)]
+    pdf = PDFGenerator.render_collection(data_list)
+    id_, _ = create_record_with_file(client, headers, "book.pdf", pdf.output())
+    url = f"/api/records/{id_}/files/book.pdf/pages"
+
+    res = client.get(f"{url}/2.txt")
+    assert res.status_code == 200
+    assert res.mimetype == "text/plain"
+    assert "Title 2" in res.text
+    assert (
+        client.get(f"{url}/2.txt", headers={"If-None-Match": res.etag}).status_code
+        == 304
+    )
+    assert client.get(f"{url}/4.txt").status_code == 404
+
+    misses = cache.misses
+    res = client.get(f"{url}/2.jpg?width=500")
+    assert res.status_code == 200
+    assert res.mimetype == "image/jpeg"
+    assert res.cache_control.max_age == 24 * 60 * 60
+    # rounded up to the next configured width
+    assert fitz.Pixmap(res.data).width == 800
+    assert cache.misses == misses + 1
+    hits = cache.hits
+    assert client.get(f"{url}/2.jpg?width=500").data == res.data
+    assert cache.hits == hits + 1
+    assert fitz.Pixmap(client.get(f"{url}/2.jpg").data).width == 400
+    assert client.get(f"{url}/4.jpg").status_code == 404
+    assert client.get(f"{url}/0.jpg").status_code == 404
+    assert client.get(f"{url}/1.jpg?width=0").status_code == 400
+
+    # the evicted page images are removed, not the record files
+    service = ext.records_files_service
+    image_id = service.get_page_image(system_identity, id_, "book.pdf", 2, 500).id
+    derivatives_size = ext.derivative_cache.stats()["size"]
+    monkeypatch.setitem(app.config, "RERO_FILES_PAGE_IMAGE_CACHE_SIZE", 1)
+    monkeypatch.setattr(cache, "evict_interval", 1)
+    service.get_page_image(system_identity, id_, "book.pdf", 3)
+    assert FileInstance.query.get(image_id) is None
+    assert cache.stats()["size"] == 1
+    # the page images have their own cache size
+    assert ext.derivative_cache.stats()["size"] == derivatives_size
+    res = client.get(f"/api/records/{id_}/files/book-pdf.jpg/content")
+    assert res.status_code == 200
+
+    # rendered without the cache
+    monkeypatch.setitem(app.config, "RERO_FILES_PAGE_IMAGE_CACHE_SIZE", 0)
+    res = client.get(f"{url}/1.jpg?width=2000")
+    assert res.status_code == 200
+    assert fitz.Pixmap(res.data).width == 1600